@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from HackAssembler import HackAssembler
+
+# Measures the throughput of the HackAssembler phases on synthetic ASM corpora of increasing size
+class Benchmark:
+
+    # Corpus kinds that can be generated
+    CORPORA = ['labels', 'variables', 'instructions']
+    # Default corpus sizes (number of ASM lines)
+    SIZES = [10000, 100000, 1000000]
+    # Number of distinct labels that are jumped to (declared early, so that their ROM addresses fit into an A-instruction)
+    JUMP_TARGETS = 2000
+    # Number of distinct variables (they are allocated from RAM[16] on, which must stay below the screen memory at 16384)
+    VARIABLES = 16000
+    # Mnemonics used to generate random C-instructions
+    DESTS = ['null', 'M', 'D', 'MD', 'A', 'AM', 'AD', 'AMD']
+    COMPS = ['0', '1', '-1', 'D', 'A', '!D', '!A', '-D', '-A', 'D+1', 'A+1', 'D-1', 'A-1', 'D+A', 'D-A', 'A-D', 'D&A', 'D|A', 'M', '!M', '-M', 'M+1', 'M-1', 'D+M', 'D-M', 'M-D', 'D&M', 'D|M']
+    JUMPS = ['null', 'JGT', 'JEQ', 'JGE', 'JLT', 'JNE', 'JLE', 'JMP']
+
+    # Initializes a Benchmark instance; the random generator is seeded so that corpora are identical across runs
+    def __init__(self, seed=2048):
+        self.seed = seed
+
+    # Generates a corpus of the given kind with the given number of lines, returned as list of lines
+    def generate(self, kind, size):
+        rand = random.Random(self.seed)
+        lines = []
+        index = 0
+        while len(lines) < size:
+            # Label-heavy: every few lines a label declaration, and lots of (forward and backward) jumps between labels
+            if kind == 'labels':
+                lines.append('(L' + str(index) + ')')
+                lines.append('@L' + str(rand.randrange(min(index + 50, self.JUMP_TARGETS))))
+                lines.append('D;JNE')
+                lines.append('// loop ' + str(index))
+            # Variable-heavy: loads and stores of many distinct variables
+            elif kind == 'variables':
+                lines.append('@v' + str(rand.randrange(self.VARIABLES)))
+                lines.append('D=M')
+                lines.append('@v' + str(rand.randrange(self.VARIABLES)))
+                lines.append('M=D+M')
+            # C-instruction-heavy: random computations with an occasional numeric A-instruction
+            else:
+                lines.append('@' + str(rand.randrange(32768)))
+                for i in range(7):
+                    lines.append(self.randomInstruction(rand))
+            index += 1
+        return lines[:size]
+
+    # Returns a random C-instruction
+    def randomInstruction(self, rand):
+        dest, comp, jump = rand.choice(self.DESTS), rand.choice(self.COMPS), rand.choice(self.JUMPS)
+        return (dest + '=' if dest != 'null' else '') + comp + (';' + jump if jump != 'null' else '')
+
+    # Assembles a corpus (list of lines) phase by phase and returns the time spent in each phase (in seconds)
+    def timePhases(self, lines, outdir):
+        assembler = HackAssembler()
+        phases = {}
+        start = time.perf_counter()
+        parser = assembler.parse(lines)
+        phases['parse'] = time.perf_counter() - start
+        start = time.perf_counter()
+        assembler.encode(parser)
+        phases['encode'] = time.perf_counter() - start
+        start = time.perf_counter()
+        assembler.backpatch(assembler.symtable)
+        phases['symbols'] = time.perf_counter() - start
+        start = time.perf_counter()
+        assembler.writeHack(os.path.join(outdir, 'benchmark.hack'))
+        phases['write'] = time.perf_counter() - start
+        return phases
+
+    # Assembles a corpus once more under tracemalloc and returns the peak memory (in bytes) allocated by the assembler
+    def peakMemory(self, lines, outdir):
+        tracemalloc.start()
+        assembler = HackAssembler()
+        assembler.assemble(lines)
+        assembler.writeHack(os.path.join(outdir, 'benchmark.hack'))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    # Runs the benchmark for all given corpus kinds and sizes and returns the results as a JSON-serializable dictionary
+    def run(self, kinds, sizes, repeat=3, memory=True):
+        results = []
+        with tempfile.TemporaryDirectory() as outdir:
+            for kind in kinds:
+                for size in sizes:
+                    lines = self.generate(kind, size)
+                    # Keep the fastest of several runs for each phase, which is the least disturbed by other processes
+                    runs = [self.timePhases(lines, outdir) for i in range(repeat)]
+                    phases = {phase: min(run[phase] for run in runs) for phase in runs[0]}
+                    total = sum(phases.values())
+                    result = {'corpus': kind, 'lines': size, 'seconds': phases, 'total': total, 'linesPerSecond': size / total}
+                    if memory:
+                        result['peakMemory'] = self.peakMemory(lines, outdir)
+                    results.append(result)
+                    self.printResult(result)
+        return {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+
+    # Prints a single result as one line of the report
+    def printResult(self, result):
+        phases = '  '.join(phase + ' {:7.3f}s'.format(seconds) for phase, seconds in result['seconds'].items())
+        memory = '  peak {:8.1f} MB'.format(result['peakMemory'] / 1e6) if 'peakMemory' in result else ''
+        print('{:<12} {:>9} lines  {}  {:>10.0f} lines/s{}'.format(result['corpus'], result['lines'], phases, result['linesPerSecond'], memory))
+
+    # Compares results against stored baseline results and returns the number of measurements that got slower by more than the tolerance
+    def compare(self, results, baseline, tolerance):
+        regressions = 0
+        previous = {(result['corpus'], result['lines']): result for result in baseline['results']}
+        print('\nComparison against baseline (ratios > 1 are faster / use less memory):')
+        for result in results['results']:
+            old = previous.get((result['corpus'], result['lines']))
+            if old is None:
+                continue
+            speedup = result['linesPerSecond'] / old['linesPerSecond']
+            phases = '  '.join(phase + ' {:5.2f}x'.format(old['seconds'][phase] / seconds) for phase, seconds in result['seconds'].items() if seconds > 0 and phase in old['seconds'])
+            memory = ''
+            if 'peakMemory' in result and 'peakMemory' in old:
+                memory = '  memory {:5.2f}x'.format(old['peakMemory'] / result['peakMemory'])
+            slower = speedup < 1 - tolerance
+            regressions += slower
+            print('{:<12} {:>9} lines  total {:5.2f}x  {}{}{}'.format(result['corpus'], result['lines'], speedup, phases, memory, '  REGRESSION' if slower else ''))
+        return regressions
+
+# Command line interface: runs the benchmark, writes the results to a JSON-file and optionally compares them to a baseline
+def main():
+    argparser = argparse.ArgumentParser(description='Measures the HackAssembler throughput on synthetic ASM corpora.')
+    argparser.add_argument('--corpora', nargs='+', choices=Benchmark.CORPORA, default=Benchmark.CORPORA, help='corpus kinds to generate')
+    argparser.add_argument('--sizes', nargs='+', type=int, default=Benchmark.SIZES, help='corpus sizes in lines')
+    argparser.add_argument('--repeat', type=int, default=3, help='number of timed runs per corpus (the fastest one counts)')
+    argparser.add_argument('--no-memory', action='store_true', help='skip the (slow) peak memory measurement')
+    argparser.add_argument('--output', default='benchmark.json', help='JSON-file to write the results to')
+    argparser.add_argument('--baseline', help='JSON-file with stored results to compare against')
+    argparser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown against the baseline reported as regression')
+    args = argparser.parse_args()
+    benchmark = Benchmark()
+    results = benchmark.run(args.corpora, args.sizes, args.repeat, not args.no_memory)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    # Exit with an error status if there are regressions, so the benchmark can be used as a check
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            if benchmark.compare(results, json.load(baseline), args.tolerance) > 0:
+                sys.exit(1)
+
+# Kick off the benchmark when run as a script
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,23 @@
 # Translates symbolic hack-mnemonics into binary code
 class Code:
 
+    # Bit pattern common to all C-instructions ('111' followed by 13 bits for comp/dest/jump)
+    C_PREFIX = 0b111 << 13
+
     # This constructor initializes a Code instance and creates three mnemonic mapping dictionaries
     def __init__(self):
-        # Dictionary to translate from 'dest' mnemonic to binary code
-        self.DestToBinary = {"null": "000", "M": "001", "D": "010", "MD": "011", "A": "100", "AM": "101", "AD": "110", "AMD": "111"}
-        # Dictionary to translate from 'comp' mnemonic to binary code
-        self.CompToBinary = {"0": "0101010", "1": "0111111", "-1": "0111010", "D": "0001100", "A": "0110000", "!D": "0001101", "!A": "0110001", "-D": "0001111", "-A": "0110011", "D+1": "0011111", "A+1": "0110111", "D-1": "0001110", "A-1": "0110010", "D+A": "0000010", "D-A": "0010011", "A-D": "0000111", "D&A": "0000000", "D|A": "0010101", "M": "1110000", "!M": "1110001", "-M": "1110011", "M+1": "1110111", "M-1": "1110010", "D+M": "1000010", "D-M": "1010011", "M-D": "1000111", "D&M": "1000000", "D|M": "1010101"}
-        # Dictionary to translate from 'jump' mnemonic to binary code
-        self.JumpToBinary = {"null": "000", "JGT": "001", "JEQ": "010", "JGE": "011", "JLT": "100", "JNE": "101", "JLE": "110", "JMP": "111"}
+        # Dictionary to translate from 'dest' mnemonic to its bits, already shifted to their position in the instruction
+        self.DestToBinary = {"null": 0b000, "M": 0b001, "D": 0b010, "MD": 0b011, "A": 0b100, "AM": 0b101, "AD": 0b110, "AMD": 0b111}
+        self.DestToBinary = {dst: bits << 3 for dst, bits in self.DestToBinary.items()}
+        # Dictionary to translate from 'comp' mnemonic to its bits, already shifted to their position in the instruction
+        # (commutative operations are accepted in both operand orders, e.g. 'D+A' and 'A+D')
+        self.CompToBinary = {"0": 0b0101010, "1": 0b0111111, "-1": 0b0111010, "D": 0b0001100, "A": 0b0110000, "!D": 0b0001101, "!A": 0b0110001, "-D": 0b0001111, "-A": 0b0110011, "D+1": 0b0011111, "A+1": 0b0110111, "D-1": 0b0001110, "A-1": 0b0110010, "D+A": 0b0000010, "D-A": 0b0010011, "A-D": 0b0000111, "D&A": 0b0000000, "D|A": 0b0010101, "M": 0b1110000, "!M": 0b1110001, "-M": 0b1110011, "M+1": 0b1110111, "M-1": 0b1110010, "D+M": 0b1000010, "D-M": 0b1010011, "M-D": 0b1000111, "D&M": 0b1000000, "D|M": 0b1010101,
+                             "A+D": 0b0000010, "A&D": 0b0000000, "A|D": 0b0010101, "M+D": 0b1000010, "M&D": 0b1000000, "M|D": 0b1010101}
+        self.CompToBinary = {cmp: bits << 6 for cmp, bits in self.CompToBinary.items()}
+        # Dictionary to translate from 'jump' mnemonic to its bits
+        self.JumpToBinary = {"null": 0b000, "JGT": 0b001, "JEQ": 0b010, "JGE": 0b011, "JLT": 0b100, "JNE": 0b101, "JLE": 0b110, "JMP": 0b111}
+        # Cache of complete C-instruction words, filled on first use of each (dest, comp, jump) combination
+        self.instructionCache = {}
 
     # This method returns the binary code mapping of a 'dest' mnemonic
     def dest(self, dst):
@@ -21,3 +30,11 @@ class Code:
     # This method returns the binary code mapping of a 'jump' mnemonic
     def jump(self, jmp):
         return self.JumpToBinary[jmp]
+
+    # This method returns the complete 16-bit C-instruction word for the given mnemonics
+    def instruction(self, dst, cmp, jmp):
+        key = (dst, cmp, jmp)
+        word = self.instructionCache.get(key)
+        if word is None:
+            word = self.instructionCache[key] = self.C_PREFIX | self.comp(cmp) | self.dest(dst) | self.jump(jmp)
+        return word
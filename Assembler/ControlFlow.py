@@ -0,0 +1,92 @@
+from SymbolTable import SymbolTable
+
+# Control-flow rewrite rules for the Optimizer, based on the label graph of the parsed program
+# Like the peephole rules, they assume that jumps only ever target label declarations
+
+# Builds the first-pass symbol table of a list of commands, mapping each label to the index of its declaration
+# Returns the symbol table together with the set of declared label names (the table also holds the predefined symbols)
+def labelTable(commands):
+    symtable = SymbolTable()
+    labels = set()
+    for index, command in enumerate(commands):
+        if command.type == 'L_COMMAND':
+            symtable.addEntry(command.symbol, index)
+            labels.add(command.symbol)
+    return symtable, labels
+
+# Returns True if a command is a jump whose target is the A-register value loaded by the preceding instruction
+# (i.e. a C-instruction with a jump which doesn't overwrite A or any other register)
+def isPlainJump(command):
+    return command is not None and command.type == 'C_COMMAND' and command.jump != 'null' and command.dest == 'null'
+
+# Returns the command at an index, or None if the index is past the end of the program
+def commandAt(commands, index):
+    return commands[index] if index < len(commands) else None
+
+# Rewrite rule: retargets jumps to labels which only jump on unconditionally ('@L / 0;JMP ... (L) @M / 0;JMP')
+# to the final destination of the chain, so the intermediate jumps are not executed (and may become unreferenced)
+def threadJumps(commands):
+    symtable, labels = labelTable(commands)
+    # Determine the label each label's code unconditionally jumps on to, if any
+    forward = {}
+    for label in labels:
+        index = symtable.getAddress(label) + 1
+        while commandAt(commands, index) is not None and commands[index].type == 'L_COMMAND':
+            index += 1
+        target, jump = commandAt(commands, index), commandAt(commands, index + 1)
+        if target is not None and target.type == 'A_COMMAND' and target.symbol in labels and isPlainJump(jump) and jump.jump == 'JMP':
+            forward[label] = target.symbol
+    # Follow each chain to its end (stopping at loops such as '(END) @END / 0;JMP')
+    final = {}
+    for label in forward:
+        visited = {label}
+        target = forward[label]
+        while target in forward and forward[target] not in visited:
+            visited.add(target)
+            target = forward[target]
+        final[label] = target
+    # Retarget jumps: the fall-through path of a conditional jump must not depend on A, so it must load A itself
+    result = list(commands)
+    for index, command in enumerate(commands):
+        if command.type == 'A_COMMAND' and command.symbol in final and isPlainJump(commandAt(commands, index + 1)):
+            following = commandAt(commands, index + 2)
+            if commands[index + 1].jump == 'JMP' or (following is not None and following.type == 'A_COMMAND'):
+                result[index] = command._replace(symbol=final[command.symbol])
+    return result
+
+# Rewrite rule: removes all instructions that cannot be reached from the program start
+# Code is reachable by falling through, by a direct jump ('@L' followed by a jump) from reachable code, or by a computed
+# jump; the latter can only target labels whose address is used as data (e.g. '@L / D=A' to push a return address)
+def removeUnreachableCode(commands):
+    symtable, labels = labelTable(commands)
+    # Start from the first instruction and from all labels whose address is used as data
+    starts = [0]
+    for index, command in enumerate(commands):
+        if command.type == 'A_COMMAND' and command.symbol in labels and not isPlainJump(commandAt(commands, index + 1)):
+            starts.append(symtable.getAddress(command.symbol))
+    # Walk the program from all starting points
+    reached = [False] * len(commands)
+    while starts:
+        index = starts.pop()
+        while index < len(commands) and not reached[index]:
+            reached[index] = True
+            command = commands[index]
+            if command.type == 'C_COMMAND' and command.jump != 'null':
+                previous = commands[index - 1] if index > 0 else None
+                # Direct jump to a label: continue the walk there as well
+                if previous is not None and previous.type == 'A_COMMAND' and 'A' not in command.dest:
+                    if previous.symbol not in labels:
+                        # Jump to a numeric address or non-label symbol: targets are unknown, so leave the program as it is
+                        return commands
+                    starts.append(symtable.getAddress(previous.symbol))
+                # An unconditional jump never falls through
+                if command.jump == 'JMP':
+                    break
+            index += 1
+    # Keep the reached commands (unreached labels can only be referenced by unreached code)
+    return [command for index, command in enumerate(commands) if reached[index]]
+
+# Rewrite rule: removes declarations of labels which are never referenced, so they no longer limit the peephole rules
+def removeUnusedLabels(commands):
+    referenced = {command.symbol for command in commands if command.type == 'A_COMMAND'}
+    return [command for command in commands if command.type != 'L_COMMAND' or command.symbol in referenced]
@@ -1,64 +1,324 @@
 import sys
+import struct
+import argparse
+import itertools
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from Parser import Parser
 from Code import Code
 from SymbolTable import SymbolTable
+from Optimizer import Optimizer
 
-# Coordinates the ASM-file parsing process and assembles code to an output Hack-file
+# Coordinates the ASM parsing process and assembles code to Hack binary code, in memory or to an output Hack-file
 class HackAssembler:
 
-    # Initializes a HackAssembler instance and creates a Hack binary code file
-    def __init__(self):
-        # Get input argument which is the ASM-file to be assembled into Hack binary code
-        filename = sys.argv[1]
-        # Create a Parser instance for a first parse to build the symbol table
-        preparser = Parser(filename)
-        # Create a Symbol Table
-        symtable = SymbolTable()
-        # Carry out first parse and build up symbol table, initializin the line counter with 0
-        lineCounter = 0
-        # Parse all commands and add symbols to table while keeping track of the line number
-        while preparser.hasMoreCommands() == True:
-                # Move ahead one line in the list of ASM-commands
-                preparser.advance()
-                # In case of an A- or C-instruction, increase line counter by 1
-                if (preparser.commandType() == 'A_COMMAND' or preparser.commandType() == 'C_COMMAND'):
-                    lineCounter += 1
-                # In case of a label declaration, add symbol to the symbol table
-                elif preparser.commandType() == 'L_COMMAND':
-                    symtable.addEntry(preparser.symbol(), lineCounter)
-        # Create a Code instance and a second Parser instance for the main parse of the ASM-file
-        decoder = Code()
-        parser = Parser(filename)
+    # Textual binary representation of every byte value, used to format 16-bit words two bytes at a time
+    BYTE_TO_BITS = [format(byte, '08b') for byte in range(256)]
+    # Number of instruction words collected in memory before they are written out in streaming mode
+    STREAM_BUFFER = 1 << 16
+    # Number of ASM lines handed to a worker process at a time in parallel mode
+    CHUNK_SIZE = 1 << 15
+
+    # Initializes a HackAssembler instance, which can assemble any number of programs one after another
+    # If an Optimizer instance is given, assemble() runs it on the parsed commands before encoding them
+    def __init__(self, optimizer=None):
+        # The Code instance (and its cache of instruction words) is shared by all programs assembled by this instance
+        self.decoder = Code()
+        self.optimizer = optimizer
+        # Symbol table and ROM image of the most recently assembled program
+        self.symtable = None
+        self.instructions = array('H')
+
+    # Assembles ASM source code (a string, a list of lines or any iterator over lines) in a single pass and returns the ROM image
+    def assemble(self, source):
+        parser = self.parse(source)
+        self.encode(parser)
+        # Backpatch the pending references in the order they occurred
+        self.backpatch(self.symtable)
+        return self.instructions
+
+    # Parses the source code (and optimizes it, if an optimizer is set) and returns the Parser ready for encoding
+    def parse(self, source):
+        parser = Parser(source)
+        # Optimize the whole list of parsed commands before any of them is encoded
+        if self.optimizer is not None:
+            parser.commands = self.optimizer.optimize(parser.commands)
+        # Keep the (optimized) commands, which the listing maps the ROM addresses back to
+        self.commands = parser.commands
+        return parser
+
+    # Translates all commands of a Parser into the ROM image, adding labels to a fresh Symbol Table and collecting forward references
+    def encode(self, parser):
+        self.symtable = symtable = SymbolTable()
+        decoder = self.decoder
+        # Initialize the ROM image as an array of unsigned 16-bit words (its length is the current ROM address)
+        self.instructions = array('H')
+        # Initialize the list of pending forward references as (ROM address, symbol) pairs
+        self.fixups = []
+        # Parse all commands, add labels to the symbol table and translate instructions as they come
+        while parser.hasMoreCommands() == True:
+            # Move ahead one command and get its pre-tokenized record
+            parser.advance()
+            command = parser.current_command
+            # In case of an A-instruction, translate the address if it is already known
+            if command.type == 'A_COMMAND':
+                # If address is numeric, the address itself is the instruction word
+                if command.symbol.isnumeric() == True:
+                    self.instructions.append(int(command.symbol))
+                # If address is a symbol that is already known (predefined or declared label), store its address
+                elif symtable.contains(command.symbol):
+                    self.instructions.append(symtable.getAddress(command.symbol))
+                # Else it's a forward label reference or a variable --> Reserve the ROM word and patch it later
+                else:
+                    self.fixups.append((len(self.instructions), command.symbol))
+                    self.instructions.append(0)
+            # In case of a C-instruction, look up the complete instruction word
+            elif command.type == 'C_COMMAND':
+                self.instructions.append(decoder.instruction(command.dest, command.comp, command.jump))
+            # In case of a label declaration, add symbol with the address of the next instruction to the symbol table
+            elif command.type == 'L_COMMAND':
+                symtable.addEntry(command.symbol, len(self.instructions), 'label')
+
+    # Resolves the pending forward references once all labels are known
+    def backpatch(self, symtable):
         # Initialize counter for variables
         varCounter = 0
-        # Create hack-file and prepare it for writing
-        with open(filename.split('.')[0] + '.hack', 'w') as hack:
-            # Parse all commands and write hack binary code to the hack-file
-            while parser.hasMoreCommands() == True:
-                # Move ahead one line in the list of ASM-commands
-                parser.advance()
-                # In case of an A-instruction, write 16-bit binary representation of the address to the Hack-file
-                if parser.commandType() == 'A_COMMAND':
-                    # If address is numeric, write 16-bit binary representation to file (cut leading '0b' after conversion)
-                    if parser.symbol().isnumeric() == True:
-                        hack.write(str(bin(int(parser.symbol()))[2:]).zfill(16))
-                    # If address is a symbol, get address from symbol table and write 16-bit binary representation to file (cut leading '0b' after conversion)
-                    elif symtable.contains(parser.symbol()): 
-                        hack.write(str(bin(symtable.getAddress(parser.symbol()))[2:]).zfill(16))
-                    # Else it's a variable symbol --> Add it to the symbol table and write to hack
-                    else:
-                        # Add entry to symbol table starting with address 16 (RAM[16])
-                        symtable.addEntry(parser.symbol(), varCounter+16)
-                        # Write 16-bit binary representation to file (cut leading '0b' after conversion)
-                        hack.write(str(bin(varCounter+16)[2:]).zfill(16))
-                        # Increase variable counter
-                        varCounter += 1
-                # In case of a C-instruction, build up 16-bit binary representation and write it to Hack-file
-                elif parser.commandType() == 'C_COMMAND':
-                    hack.write('111' + decoder.comp(parser.comp()) + decoder.dest(parser.dest()) + decoder.jump(parser.jump()))
-                # If there are more ASM-commands and current command was not a label declaration, then write a new line
-                if (parser.hasMoreCommands() == True) and (parser.commandType() != 'L_COMMAND'):
-                    hack.write('\n')
-
-# Create a HackAssembler instance which kicks off the assembly process 
-assemble = HackAssembler()
\ No newline at end of file
+        for address, symbol in self.fixups:
+            # A symbol that has not been declared as a label by now is a variable --> Add it to the symbol table starting with address 16 (RAM[16])
+            if not symtable.contains(symbol):
+                symtable.addEntry(symbol, varCounter+16, 'variable')
+                varCounter += 1
+            self.instructions[address] = symtable.getAddress(symbol)
+
+    # Assembles ASM source code (a string, a list of lines or any iterator over lines) on a pool of worker processes
+    # Fixed-size chunks of lines are parsed and encoded in parallel, then stitched together in order and resolved in one
+    # ordered scan over the symbolic references, so the ROM image is identical to the one of assemble()
+    def assembleParallel(self, source, jobs=None, chunkSize=None):
+        if isinstance(source, str):
+            source = source.splitlines()
+        chunkSize = chunkSize or self.CHUNK_SIZE
+        # Split the source code into lists of lines of fixed size
+        lines = iter(source)
+        chunks = iter(lambda: list(itertools.islice(lines, chunkSize)), [])
+        self.symtable = symtable = SymbolTable()
+        self.instructions = array('H')
+        references = []
+        # Encode the chunks on the worker processes and stitch the results together in chunk order
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for words, labels, refs in executor.map(encodeChunk, chunks):
+                # Chunk-relative addresses become ROM addresses by adding the address of the chunk's first word
+                base = len(self.instructions)
+                self.instructions.extend(words)
+                for symbol, address in labels:
+                    symtable.addEntry(symbol, base + address, 'label')
+                references.extend((base + address, symbol) for address, symbol in refs)
+        # Ordered scan over all symbolic references: all labels are known by now, so the remaining symbols are variables
+        self.fixups = references
+        self.backpatch(symtable)
+        return self.instructions
+
+    # Assembles ASM source code streamed line by line (e.g. from a huge ASM-file) and writes the Hack code incrementally
+    # Only the symbol table, the pending forward references and a bounded output buffer are held in memory
+    # hackfile (and optionally binfile) must be files opened for binary writing, as words are patched in place afterwards
+    def assembleStream(self, source, hackfile, binfile=None):
+        self.symtable = symtable = SymbolTable()
+        decoder = self.decoder
+        self.hackfile = hackfile
+        self.binfile = binfile
+        # Buffer of instruction words not yet written out, and the ROM address of its first word
+        self.instructions = buffer = array('H')
+        self.flushed = 0
+        # Pending forward references as {symbol: array of ROM addresses}, in order of first occurrence of the symbol
+        pending = {}
+        # Parse all commands as they are read and translate instructions as they come
+        for command in Parser.stream(source):
+            # In case of an A-instruction, translate the address if it is already known, else reserve the word
+            if command.type == 'A_COMMAND':
+                if command.symbol.isnumeric() == True:
+                    buffer.append(int(command.symbol))
+                elif symtable.contains(command.symbol):
+                    buffer.append(symtable.getAddress(command.symbol))
+                else:
+                    if command.symbol not in pending:
+                        pending[command.symbol] = array('L')
+                    pending[command.symbol].append(self.flushed + len(buffer))
+                    buffer.append(0)
+            # In case of a C-instruction, look up the complete instruction word
+            elif command.type == 'C_COMMAND':
+                buffer.append(decoder.instruction(command.dest, command.comp, command.jump))
+            # In case of a label declaration, add it to the symbol table and patch the references waiting for it right away
+            elif command.type == 'L_COMMAND':
+                address = self.flushed + len(buffer)
+                symtable.addEntry(command.symbol, address, 'label')
+                for reference in pending.pop(command.symbol, ()):
+                    self.patch(reference, address)
+            # Write out the buffer once it is full
+            if len(buffer) >= self.STREAM_BUFFER:
+                self.flush()
+        self.flush()
+        # All symbols still pending are variables --> Allocate them starting with address 16 (RAM[16]) in order of first use
+        varCounter = 0
+        for symbol, references in pending.items():
+            symtable.addEntry(symbol, varCounter+16, 'variable')
+            varCounter += 1
+            for reference in references:
+                self.patch(reference, symtable.getAddress(symbol))
+
+    # Writes the buffered instruction words to the output files and empties the buffer (streaming mode)
+    def flush(self):
+        if len(self.instructions) == 0:
+            return
+        bits = self.BYTE_TO_BITS
+        # Instructions are separated by new lines, so the word at ROM address i always starts at byte 17*i of the hack-file
+        text = '\n'.join([bits[word >> 8] + bits[word & 0xFF] for word in self.instructions])
+        self.hackfile.write((text if self.flushed == 0 else '\n' + text).encode('ascii'))
+        if self.binfile is not None:
+            words = array('H', self.instructions)
+            if sys.byteorder == 'little':
+                words.byteswap()
+            self.binfile.write(words.tobytes())
+        self.flushed += len(self.instructions)
+        del self.instructions[:]
+
+    # Overwrites the instruction word at a ROM address, either in the buffer or in the already written output files (streaming mode)
+    def patch(self, address, word):
+        if address >= self.flushed:
+            self.instructions[address - self.flushed] = word
+            return
+        bits = self.BYTE_TO_BITS
+        self.hackfile.seek(17 * address)
+        self.hackfile.write((bits[word >> 8] + bits[word & 0xFF]).encode('ascii'))
+        self.hackfile.seek(0, 2)
+        if self.binfile is not None:
+            self.binfile.seek(2 * address)
+            self.binfile.write(struct.pack('>H', word))
+            self.binfile.seek(0, 2)
+
+    # Writes the sym-file, mapping every label to its ROM address and every variable to its RAM address
+    # Each line holds the address, the memory ('ROM' for labels, 'RAM' for variables) and the symbol, sorted by memory and address
+    def writeSymbols(self, filename):
+        memory = {'label': 'ROM', 'variable': 'RAM'}
+        entries = sorted((memory[kind], self.symtable.getAddress(symbol), symbol) for symbol, kind in self.symtable.kinds.items())
+        with open(filename, 'w') as sym:
+            for mem, address, symbol in entries:
+                sym.write(str(address) + ' ' + mem + ' ' + symbol + '\n')
+
+    # Writes the lst-file, mapping each ROM address to its instruction word and the ASM source line it was assembled from
+    # Label declarations are listed without an address right before the instruction they point to
+    def writeListing(self, filename):
+        bits = self.BYTE_TO_BITS
+        address = 0
+        with open(filename, 'w') as lst:
+            lst.write('ROM    Hack code           Line  Source\n')
+            for command in self.commands:
+                if command.type == 'L_COMMAND':
+                    lst.write(' ' * 25 + '{:>6}  ({})\n'.format(command.line or '', command.symbol))
+                    continue
+                word = self.instructions[address]
+                if command.type == 'A_COMMAND':
+                    source = '@' + command.symbol
+                else:
+                    source = (command.dest + '=' if command.dest != 'null' else '') + command.comp + (';' + command.jump if command.jump != 'null' else '')
+                lst.write('{:05}  {}  {:>6}  {}\n'.format(address, bits[word >> 8] + bits[word & 0xFF], command.line or '', source))
+                address += 1
+
+    # Writes the ROM image as hack-file, with the 16-bit binary representation of one instruction per line
+    def writeHack(self, filename):
+        bits = self.BYTE_TO_BITS
+        with open(filename, 'w') as hack:
+            hack.write('\n'.join([bits[word >> 8] + bits[word & 0xFF] for word in self.instructions]))
+
+    # Writes the ROM image as packed big-endian 16-bit words, which a loader can map into ROM without parsing text
+    def writeBinary(self, filename):
+        words = array('H', self.instructions)
+        if sys.byteorder == 'little':
+            words.byteswap()
+        with open(filename, 'wb') as binary:
+            words.tofile(binary)
+
+# Parses and encodes one chunk of ASM lines (runs in a worker process of the parallel mode)
+# Returns the chunk's instruction words, its label declarations and its references to non-predefined symbols,
+# all with addresses relative to the chunk's first instruction word
+def encodeChunk(lines):
+    decoder = Code()
+    predefined = SymbolTable()
+    words = array('H')
+    labels = []
+    refs = []
+    for command in Parser.stream(lines):
+        if command.type == 'A_COMMAND':
+            if command.symbol.isnumeric() == True:
+                words.append(int(command.symbol))
+            elif predefined.contains(command.symbol):
+                words.append(predefined.getAddress(command.symbol))
+            else:
+                refs.append((len(words), command.symbol))
+                words.append(0)
+        elif command.type == 'C_COMMAND':
+            words.append(decoder.instruction(command.dest, command.comp, command.jump))
+        elif command.type == 'L_COMMAND':
+            labels.append((command.symbol, len(words)))
+    return words, labels, refs
+
+# Assembles ASM source code in memory and returns the ROM image (array of 16-bit words) together with the symbol table
+def assemble(source):
+    assembler = HackAssembler()
+    instructions = assembler.assemble(source)
+    return instructions, assembler.symtable
+
+# Command line interface: assembles an ASM-file into a Hack-file next to it
+def main():
+    # Get input arguments: the ASM-file to be assembled into Hack binary code and the output options
+    argparser = argparse.ArgumentParser(description='Assembles a Hack ASM-file into Hack binary code.')
+    argparser.add_argument('asmfile', help='ASM-file to be assembled')
+    argparser.add_argument('--binary', action='store_true', help='additionally write the program as packed 16-bit words to a BIN-file')
+    argparser.add_argument('--stream', action='store_true', help='stream the ASM-file and write the output incrementally, keeping memory use flat for very large files')
+    argparser.add_argument('--jobs', type=int, default=1, help='parse and encode chunks of the ASM-file on this many worker processes (0: one per CPU)')
+    argparser.add_argument('--optimize', action='store_true', help='run the peephole optimizer on the parsed program before encoding it')
+    argparser.add_argument('--symbols', action='store_true', help='write a SYM-file mapping every label and variable to its address')
+    argparser.add_argument('--listing', action='store_true', help='write a LST-file mapping each ROM address back to its ASM source line')
+    args = argparser.parse_args()
+    # The optimizer needs the whole program in memory and runs on a single process
+    if args.optimize and (args.stream or args.jobs != 1):
+        argparser.error('--optimize cannot be combined with --stream or --jobs')
+    # The listing needs the parsed commands, which are only kept when assembling in memory on a single process
+    if args.listing and (args.stream or args.jobs != 1):
+        argparser.error('--listing cannot be combined with --stream or --jobs')
+    assembler = HackAssembler(Optimizer() if args.optimize else None)
+    basename = args.asmfile.split('.')[0]
+    try:
+        assembleFile(assembler, args, basename)
+    # Invalid assembly code (e.g. a label declared twice) is reported without a traceback
+    except ValueError as error:
+        sys.exit(args.asmfile + ': ' + str(error))
+
+# Assembles the ASM-file given on the command line and writes the requested output files
+def assembleFile(assembler, args, basename):
+    # In streaming mode, the output files are written while the ASM-file is read
+    if args.stream:
+        with open(args.asmfile) as asmfile, open(basename + '.hack', 'wb') as hackfile:
+            if args.binary:
+                with open(basename + '.bin', 'wb') as binfile:
+                    assembler.assembleStream(asmfile, hackfile, binfile)
+            else:
+                assembler.assembleStream(asmfile, hackfile)
+    # Else assemble the ASM-file, which is read line by line, either sequentially or on a pool of worker processes
+    else:
+        with open(args.asmfile) as asmfile:
+            if args.jobs == 1:
+                assembler.assemble(asmfile)
+            else:
+                assembler.assembleParallel(asmfile, args.jobs or None)
+        # Create hack-file and, if requested, bin-file next to it
+        assembler.writeHack(basename + '.hack')
+        if args.binary:
+            assembler.writeBinary(basename + '.bin')
+    # If requested, create sym-file and lst-file next to the hack-file
+    if args.symbols:
+        assembler.writeSymbols(basename + '.sym')
+    if args.listing:
+        assembler.writeListing(basename + '.lst')
+
+# Kick off the assembly process when run as a script
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+from Parser import Command
+from ControlFlow import threadJumps, removeUnreachableCode, removeUnusedLabels
+
+# Peephole optimizer, run on the list of parsed command records before they are encoded
+# A rewrite rule is any function taking a list of command records and returning an equivalent (shorter) list
+# The analysis assumes that jumps only ever target label declarations, as in all symbolic Hack assembly code
+class Optimizer:
+
+    # Initializes an Optimizer instance with the given rewrite rules (by default all rules of this module)
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = [threadJumps, removeUnreachableCode, removeUnusedLabels, cancelStackPointerPairs, dropRedundantLoads, removeDeadCode]
+        self.rules = list(rules)
+        # Number of instructions (ROM words) removed by each rule, by rule name
+        self.removed = {}
+
+    # This method registers an additional rewrite rule, which runs after the already registered ones
+    def addRule(self, rule):
+        self.rules.append(rule)
+
+    # This method applies all rules over and over until none of them shortens the program any further
+    def optimize(self, commands):
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.rules:
+                before, words = len(commands), instructionCount(commands)
+                commands = rule(commands)
+                if len(commands) < before:
+                    self.removed[rule.__name__] = self.removed.get(rule.__name__, 0) + words - instructionCount(commands)
+                    changed = True
+        return commands
+
+    # This method returns the total number of instructions removed so far
+    def totalRemoved(self):
+        return sum(self.removed.values())
+
+# Returns the number of instructions (ROM words) in a list of commands, i.e. all commands except label declarations
+def instructionCount(commands):
+    return sum(1 for command in commands if command.type != 'L_COMMAND')
+
+# Returns True if a command is the C-instruction 'dest=comp' without jump, dest being one of the given mnemonics
+def isAssignment(command, dests, comp):
+    return command.type == 'C_COMMAND' and command.dest in dests and command.comp == comp and command.jump == 'null'
+
+# Rewrite rule: replaces an increment of SP directly followed by a decrement (or vice versa) by a plain load of SP
+# '@SP / AM=M+1 / @SP / AM=M-1' leaves SP unchanged and A pointing to the stack top, just like '@SP / A=M'
+# (if the second update doesn't write A, A only holds the address of SP, just like '@SP')
+def cancelStackPointerPairs(commands):
+    result = []
+    i = 0
+    while i < len(commands):
+        window = commands[i:i+4]
+        if (len(window) == 4 and window[0].type == 'A_COMMAND' and window[0].symbol == 'SP' and window[2].type == 'A_COMMAND' and window[2].symbol == 'SP'
+                and ((isAssignment(window[1], ('M', 'AM'), 'M+1') and isAssignment(window[3], ('M', 'AM'), 'M-1'))
+                     or (isAssignment(window[1], ('M', 'AM'), 'M-1') and isAssignment(window[3], ('M', 'AM'), 'M+1')))):
+            result.append(window[0])
+            if window[3].dest == 'AM':
+                result.append(Command('C_COMMAND', None, 'A', 'M', 'null', window[3].line))
+            i += 4
+        else:
+            result.append(commands[i])
+            i += 1
+    return result
+
+# Rewrite rule: drops A-instructions loading a symbol or constant that the A-register already holds
+# The content of A is only known between a load and the next instruction writing A or the next label (a possible jump target)
+def dropRedundantLoads(commands):
+    result = []
+    loaded = None
+    for command in commands:
+        if command.type == 'A_COMMAND':
+            if command.symbol == loaded:
+                continue
+            loaded = command.symbol
+        elif command.type == 'L_COMMAND' or 'A' in command.dest:
+            loaded = None
+        result.append(command)
+    return result
+
+# Rewrite rule: removes the instructions following an unconditional jump up to the next label, as they can never be reached
+def removeDeadCode(commands):
+    result = []
+    reachable = True
+    for command in commands:
+        if command.type == 'L_COMMAND':
+            reachable = True
+        elif not reachable:
+            continue
+        elif command.type == 'C_COMMAND' and command.jump == 'JMP':
+            reachable = False
+        result.append(command)
+    return result
@@ -0,0 +1,57 @@
+# This module emulates the Hack computer (CPU, ROM and RAM) to run assembled programs in the tests
+class HackComputer:
+
+    # Address and value which the sample program writes when it has stored all its results
+    DONE_ADDRESS = 7999
+    DONE_VALUE = 12345
+
+    # This constructor loads the ROM image (a sequence of 16-bit instruction words) and clears the RAM
+    def __init__(self, instructions):
+        self.rom = list(instructions)
+        self.ram = [0] * 32768
+        self.cycles = 0
+
+    # Runs the program until it writes DONE_VALUE to DONE_ADDRESS and returns True, or returns False if it runs off the
+    # end of the ROM or exceeds the cycle limit
+    def run(self, maxCycles=5000000):
+        rom, ram = self.rom, self.ram
+        a = d = pc = 0
+        while self.cycles < maxCycles and pc < len(rom):
+            word = rom[pc]
+            self.cycles += 1
+            pc += 1
+            # A-instruction: load the constant into A
+            if not word & 0x8000:
+                a = word
+                continue
+            # C-instruction: compute with D and A (or M) according to the comp bits, then store and jump
+            x, y = d, ram[a & 0x7fff] if word & 0x1000 else a
+            if word & 0x0800:
+                x = 0
+            if word & 0x0400:
+                x = ~x & 0xffff
+            if word & 0x0200:
+                y = 0
+            if word & 0x0100:
+                y = ~y & 0xffff
+            out = (x + y) & 0xffff if word & 0x0080 else x & y
+            if word & 0x0040:
+                out = ~out & 0xffff
+            # M and the jump target are addressed by the value of A before this instruction
+            address = a & 0x7fff
+            if word & 0x0020:
+                a = out
+            if word & 0x0010:
+                d = out
+            if word & 0x0008:
+                ram[address] = out
+                if address == self.DONE_ADDRESS and out == self.DONE_VALUE:
+                    return True
+            negative, zero = out & 0x8000, out == 0
+            if (word & 4 and negative) or (word & 2 and zero) or (word & 1 and not negative and not zero):
+                pc = address
+        return False
+
+    # Returns the RAM words from address to address + count as signed integers
+    def peek(self, address, count):
+        return [word - 65536 if word & 0x8000 else word for word in self.ram[address:address + count]]
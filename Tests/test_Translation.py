@@ -0,0 +1,189 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+# The VM Translator and the Assembler are imported from their folders, just like when they are run as scripts there
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'VM_Translator'), os.path.join(ROOT, 'Assembler')]
+
+from VMTranslator import VMTranslator, translateProgram
+from HackAssembler import HackAssembler, assemble
+from Optimizer import Optimizer
+from HackComputer import HackComputer
+
+# Folder of the sample program (the Jack sources and the VM-files the Jack Compiler creates from them)
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Sample')
+# Results the sample program stores from address 8000 on
+EXPECTED = [144, 21, 5050, 0, -1, 169, 29999, -3, -21, -5, -4, -3, -2, -1, 0, 1, 2, 3, 4, 25, 10, 2, 4851, -6, -1, -1, 0, 0, 0, 0]
+
+# Code generation modes of the VM Translator, on their own and in common combinations (batchSP and cacheTop exclude
+# each other)
+MODES = [
+    {'sharedCalls': True},
+    {'sharedCompare': True},
+    {'fuse': True},
+    {'cacheTop': True},
+    {'batchSP': True},
+    {'shortIndex': 0},
+    {'shortIndex': 4},
+    {'treeShake': True},
+    {'inline': 8},
+    {'staticFrames': True},
+    {'tailCalls': True},
+    {'release': True},
+    {'sharedCalls': True, 'sharedCompare': True, 'treeShake': True},
+    {'fuse': True, 'cacheTop': True, 'shortIndex': 2},
+    {'fuse': True, 'batchSP': True, 'shortIndex': 2},
+    {'inline': 8, 'staticFrames': True, 'tailCalls': True},
+    {'sharedCalls': True, 'staticFrames': True, 'tailCalls': True},
+    {'sharedCompare': True, 'cacheTop': True, 'inline': 8},
+    {'sharedCompare': True, 'batchSP': True, 'staticFrames': True},
+    {'sharedCalls': True, 'sharedCompare': True, 'fuse': True, 'cacheTop': True, 'shortIndex': 2, 'treeShake': True, 'inline': 8, 'staticFrames': True, 'tailCalls': True, 'release': True},
+    {'sharedCalls': True, 'sharedCompare': True, 'fuse': True, 'batchSP': True, 'shortIndex': 2, 'treeShake': True, 'inline': 8, 'staticFrames': True, 'tailCalls': True, 'release': True},
+]
+
+# Translates and assembles a VM-file or folder within this interpreter, runs the program on the emulator and returns
+# its first count results
+def runProgram(userInput, assembler=None, count=len(EXPECTED), **options):
+    source = translateProgram(userInput, **options)
+    if assembler is None:
+        instructions, symtable = assemble(source)
+    else:
+        instructions = assembler.assemble(source)
+    computer = HackComputer(instructions)
+    if not computer.run():
+        raise AssertionError('the program did not finish within ' + str(computer.cycles) + ' cycles')
+    return computer.peek(8000, count)
+
+# Writes a program of one VM-file 'Sys.vm' to the folder: Sys.init evaluates each case (a list of VM commands leaving
+# one value on the stack) and stores its value from address 8000 on, the functions (VM commands) follow Sys.init
+def writeProgram(folder, cases, functions=()):
+    lines = ['function Sys.init 0']
+    for index, case in enumerate(cases):
+        lines += case + ['pop temp 0', 'push constant 8000', 'pop pointer 1', 'push temp 0', 'pop that ' + str(index)]
+    lines += ['push constant 7999', 'pop pointer 1', 'push constant 12345', 'pop that 0', 'label HALT', 'goto HALT']
+    with open(os.path.join(folder, 'Sys.vm'), 'w') as vmfile:
+        vmfile.write('\n'.join(lines + list(functions)) + '\n')
+
+# Checks the whole tool chain from the VM-files to the Hack computer
+class TranslationTest(unittest.TestCase):
+
+    # The assembly code of translateProgram is passed to the assembler directly
+    def testTranslateAndAssemble(self):
+        self.assertEqual(runProgram(SAMPLE), EXPECTED)
+
+    # Every code generation mode computes the same results as the default translation
+    def testModes(self):
+        for options in MODES:
+            with self.subTest(**options):
+                self.assertEqual(runProgram(SAMPLE, **options), EXPECTED)
+
+    # The assembler's optimizer and its parallel mode keep the results of the default and the fastest translation
+    def testAssemblerModes(self):
+        for options in [{}, MODES[-2]]:
+            with self.subTest(optimize=True, **options):
+                self.assertEqual(runProgram(SAMPLE, HackAssembler(Optimizer()), **options), EXPECTED)
+        self.assertEqual(runProgram(SAMPLE, ParallelAssembler()), EXPECTED)
+
+    # batchSP and cacheTop cannot be combined, whichever way the translator is called
+    def testBatchSPWithCacheTop(self):
+        with self.assertRaises(ValueError):
+            translateProgram(SAMPLE, batchSP=True, cacheTop=True)
+
+# Checks the code generation modes on small programs which exercise corner cases of the modes
+class CornerCaseTest(unittest.TestCase):
+
+    # Runs each test with a temporary folder for the program of its cases
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as folder:
+            self.folder = folder
+            return super().run(result)
+
+    # Checks that the cases compute the expected values in the default translation and with each of the given modes
+    def assertCases(self, modes, cases, expected, functions=()):
+        writeProgram(self.folder, cases, functions)
+        for options in [{}] + modes:
+            with self.subTest(**options):
+                self.assertEqual(runProgram(self.folder, count=len(expected), **options), expected)
+
+    # A user function named like a comparison is called, not mistaken for the comparison against zero
+    def testFunctionNamedLikeComparison(self):
+        self.assertCases([{'sharedCompare': True}, {'cacheTop': True}, {'batchSP': True}],
+                         [['push constant 5', 'push constant 0', 'call lt 1', 'add']], [8],
+                         ['function lt 0', 'push argument 0', 'push constant 3', 'add', 'return'])
+
+    # Batched comparisons far from the stack pointer (e.g. below the value of a call)
+    def testBatchedCompare(self):
+        self.assertCases([{'batchSP': True}, {'batchSP': True, 'fuse': True}],
+                         [['push constant 6', 'push constant 1', 'push constant 2', 'call Sys.three 0', 'add', 'add', 'eq'],
+                          ['push constant 9', 'push constant 2', 'push constant 3', 'push constant 4', 'add', 'add', 'eq'],
+                          ['push constant 7', 'push constant 1', 'push constant 2', 'push constant 3', 'add', 'add', 'lt']],
+                         [-1, -1, 0], ['function Sys.three 0', 'push constant 3', 'return'])
+
+    # Inlined functions keep the temp entries the program uses, and only functions returning one value are inlined
+    def testInlining(self):
+        self.assertCases([{'inline': 8}, {'inline': 8, 'cacheTop': True}],
+                         [['push constant 42', 'pop temp 7', 'push constant 5', 'call Sys.inc 1', 'pop temp 0', 'push temp 7'],
+                          ['push constant 5', 'call Sys.two 0', 'add'],
+                          ['push constant 5', 'call Sys.pick 1'],
+                          ['push constant 0', 'call Sys.pick 1']],
+                         [42, 7, 9, 7],
+                         ['function Sys.inc 0', 'push argument 0', 'push constant 1', 'add', 'return',
+                          'function Sys.two 0', 'push constant 1', 'push constant 2', 'return',
+                          'function Sys.pick 0', 'push argument 0', 'if-goto NINE', 'push constant 7', 'return', 'label NINE', 'push constant 9', 'return'])
+
+    # A call chain whose static frames exceed the variable memory keeps the standard calling convention where needed
+    def testDeepStaticFrames(self):
+        functions = []
+        for depth in range(25):
+            functions += ['function Sys.f' + str(depth) + ' 10']
+            for index in range(10):
+                functions += ['push argument 0', 'push constant ' + str(depth + index), 'add', 'pop local ' + str(index)]
+            functions += ['push argument 0', 'call Sys.f' + str(depth + 1) + ' 1'] if depth < 24 else ['push constant 0']
+            for index in range(10):
+                functions += ['push local ' + str(index), 'add']
+            functions += ['return']
+        self.assertCases([{'staticFrames': True}, {'staticFrames': True, 'sharedCalls': True, 'tailCalls': True}],
+                         [['push constant 1', 'call Sys.f0 1']], [4375], functions)
+
+# Checks the translation units of '--jobs' and '--cache' on VM-files at absolute and nested paths
+class TranslationUnitTest(unittest.TestCase):
+
+    # Runs each test with a copy of the sample program in a nested folder, given by its absolute path
+    def run(self, result=None):
+        with tempfile.TemporaryDirectory() as folder:
+            self.folder = folder
+            self.sample = os.path.join(folder, 'nested', 'Sample')
+            shutil.copytree(SAMPLE, self.sample)
+            return super().run(result)
+
+    # The units of the VM-files are named after the files, so their labels and static variables cannot clash
+    def testAbsolutePath(self):
+        for options in [{}, {'jobs': 2}, {'jobs': 2, 'fuse': True, 'cacheTop': True}]:
+            with self.subTest(**options):
+                self.assertEqual(runProgram(self.sample, **options), EXPECTED)
+
+    # A second translation reuses every unit from the cache, also for a copy of the program in another folder
+    def testCache(self):
+        cacheDir = os.path.join(self.folder, 'cache')
+        copy = os.path.join(self.folder, 'copy')
+        shutil.copytree(self.sample, copy)
+        for userInput, reused in [(self.sample, 0), (self.sample, 6), (copy, 6)]:
+            translator = VMTranslator(userInput, jobs=2, cacheDir=cacheDir, toMemory=True)
+            self.assertEqual(translator.reused, reused)
+            instructions, symtable = assemble(translator.asm)
+            computer = HackComputer(instructions)
+            self.assertTrue(computer.run())
+            self.assertEqual(computer.peek(8000, len(EXPECTED)), EXPECTED)
+
+# Assembles on two worker processes
+class ParallelAssembler(HackAssembler):
+
+    # Assembles the source code with assembleParallel
+    def assemble(self, source):
+        return self.assembleParallel(source, 2)
+
+if __name__ == '__main__':
+    unittest.main()
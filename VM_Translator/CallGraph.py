@@ -0,0 +1,113 @@
+from collections import namedtuple
+
+# Number of RAM words available for assembler variables (RAM[16] up to the stack at RAM[256])
+VARIABLE_WORDS = 256 - 16
+
+# Static frame of a function: the RAM symbols of its argument and local entries, of the saved return address and stack
+# pointer, and of the saved pointers (by pointer index) of the pointers the function sets
+Frame = namedtuple('Frame', ['argument', 'local', 'returnAddress', 'stackPointer', 'pointers'])
+
+# Call graph of a whole VM program, the basis of the program-wide passes of the VMTranslator
+# A program is a list of (VM-file name, command records) pairs in translation order
+class CallGraph:
+
+    # Builds the call graph of a program: the body of each function and the functions it calls
+    def __init__(self, program):
+        # Function name -> name of the VM-file defining it
+        self.files = {}
+        # Function name -> list of its command records, starting with the function command
+        self.bodies = {}
+        # Function name -> list of the functions it calls (one entry per call command)
+        self.calls = {}
+        # Function name -> list of the numbers of arguments passed by its call sites (Sys.init is called by the bootstrap code)
+        self.nargs = {'Sys.init': [0]}
+        for fileName, commands in program:
+            for name, body in functionBlocks(commands):
+                if name is not None:
+                    self.files[name] = fileName
+                    self.bodies[name] = body
+                    self.calls[name] = [command.arg1 for command in body if command.type == 'C_CALL']
+                    for command in body:
+                        if command.type == 'C_CALL':
+                            self.nargs.setdefault(command.arg1, []).append(command.arg2)
+
+    # Returns the set of functions reachable from the given functions via call commands (including the functions themselves)
+    def reachable(self, roots):
+        reached = set()
+        pending = list(roots)
+        while pending:
+            name = pending.pop()
+            if name not in reached:
+                reached.add(name)
+                pending.extend(self.calls.get(name, []))
+        return reached
+
+    # Returns the number of arguments a function receives at least (the smallest number passed by one of its call sites)
+    def minArguments(self, name):
+        return min(self.nargs.get(name, [0]))
+
+    # Returns True if a function can call itself directly or indirectly (i.e. it can be on the stack twice)
+    def isRecursive(self, name):
+        return name in self.reachable(self.calls.get(name, []))
+
+# Splits a list of command records into blocks of (function name, commands), each block starting with its function command
+# Commands in front of the first function command form a block with the name None
+def functionBlocks(commands):
+    blocks = []
+    name, start = None, 0
+    for index, command in enumerate(commands):
+        if command.type == 'C_FUNCTION':
+            if index > start:
+                blocks.append((name, commands[start:index]))
+            name, start = command.arg1, index
+    if len(commands) > start:
+        blocks.append((name, commands[start:]))
+    return blocks
+
+# Removes all functions that cannot be reached via call commands from the root function (tree shaking)
+# Returns the remaining program and the list of removed (VM-file name, function name, commands) triples; if the program
+# doesn't define the root function, it is returned unchanged
+def removeUnreachableFunctions(program, root='Sys.init'):
+    callgraph = CallGraph(program)
+    if root not in callgraph.bodies:
+        return program, []
+    reached = callgraph.reachable([root])
+    result, removed = [], []
+    for fileName, commands in program:
+        kept = []
+        for name, body in functionBlocks(commands):
+            if name is None or name in reached:
+                kept += body
+            else:
+                removed.append((fileName, name, body))
+        result.append((fileName, kept))
+    return result, removed
+
+# Allocates static frames for all functions that can never be on the stack twice (i.e. are not recursive), except for
+# Sys.init which the bootstrap code calls with the standard calling convention
+# Functions which can never be active at the same time share RAM: the frame of a function starts behind the frames of all
+# functions that can call it (directly or indirectly), so the frames of the program take as much RAM as its deepest call chain
+# The frames are assembler variables, so together with the static variables they must fit below the stack; a function
+# whose frame doesn't fit keeps the standard calling convention
+# Returns a dictionary mapping each such function to its Frame, and the number of RAM words of all frames
+def allocateStaticFrames(program):
+    callgraph = CallGraph(program)
+    budget = VARIABLE_WORDS - len({(fileName, command.arg2) for fileName, commands in program for command in commands if command.arg1 == 'static'})
+    static = [name for name in callgraph.bodies if name != 'Sys.init' and not callgraph.isRecursive(name)]
+    # The callers of a function (i.e. the static functions it can be called from) come first when sorted by their number of callers
+    reach = {name: callgraph.reachable(callgraph.calls[name]) for name in static}
+    callers = {name: [other for other in static if other != name and name in reach[other]] for name in static}
+    frames, end = {}, {}
+    for name in sorted(static, key=lambda name: len(callers[name])):
+        body = callgraph.bodies[name]
+        start = max([end[caller] for caller in callers[name] if caller in end], default=0)
+        arguments = max(callgraph.nargs.get(name, []) + [command.arg2 + 1 for command in body if command.type in ['C_PUSH', 'C_POP'] and command.arg1 == 'argument'], default=0)
+        locals = body[0].arg2
+        pointers = sorted({command.arg2 for command in body if command.type == 'C_POP' and command.arg1 == 'pointer'})
+        slots = ['$frame.' + str(start + index) for index in range(arguments + locals + 2 + len(pointers))]
+        if start + len(slots) > budget:
+            continue
+        frames[name] = Frame(slots[:arguments], slots[arguments:arguments + locals], slots[arguments + locals], slots[arguments + locals + 1],
+                             dict(zip(pointers, slots[arguments + locals + 2:])))
+        end[name] = start + len(slots)
+    return frames, max(end.values(), default=0)
@@ -1,11 +1,62 @@
 # This module translates a parsed VM command into Hack assembly code
 class CodeWriter:
-    
+
+    # Largest distance of a stack slot from the stack pointer in memory that is addressed relative to it (batchSP mode)
+    MAX_OFFSET = 3
+    # Counters of the translation report
+    COUNTERS = ['callSites', 'returnSites', 'callArgs', 'compareSites', 'zeroCompareSites', 'cacheHits', 'spills', 'batchedCommands', 'commits', 'staticCallSites', 'staticReturns', 'tailCalls']
+
     # This constructor opens an .asm-output file, prepares it for writing and writes some bootstrap code
-    def __init__(self, filename):
-        self.asmfile = open(filename.split('.')[0] + '.asm', 'w')
+    # With sharedCalls, call sites and returns jump to shared '$$CALL'/'$$RETURN' routines instead of inlining the frame handling
+    # With sharedCompare, eq/gt/lt jump to shared comparison routines instead of being translated inline
+    # With cacheTop, the stack top is kept in D where possible and only spilled to memory when needed
+    # With batchSP, stack slots are addressed relative to a stack pointer that is only updated at block exits (not combinable with cacheTop)
+    # With shortIndex set, segment indexes up to shortIndex use specialized templates and temp/pointer use absolute addresses
+    # Without a filename, the assembly code is kept in memory; without bootstrap, the bootstrap code is left out (such a
+    # CodeWriter translates a single VM-file as translation unit of the parallel mode)
+    def __init__(self, filename, sharedCalls=False, sharedCompare=False, cacheTop=False, batchSP=False, shortIndex=None, bootstrap=True):
+        # The assembly code is collected in a bounded buffer, which is written to the ASM-file in large chunks
+        self.asmfile = OutputBuffer(open(filename.split('.')[0] + '.asm', 'w') if filename is not None else None)
+        # Assembly code of push/pop and of the arithmetic commands other than eq/gt/lt on the memory stack, which only depends
+        # on the command and its address, rendered once (see writeTemplate); all other commands are written directly
+        self.templates = {}
+        # Prefix of the labels generated for comparisons (translation units use their file name, so their labels cannot clash)
+        self.labelPrefix = ''
+        self.sharedCalls = sharedCalls
+        self.sharedCompare = sharedCompare
+        self.cacheTop = cacheTop
+        # True while the stack top lives in D instead of RAM[SP-1] (i.e. the stack pointer is one below its actual value)
+        self.topInD = False
+        # Count the commands which found the stack top in D, and the spills of D to memory
+        self.cacheHits = 0
+        self.spills = 0
+        self.batchSP = batchSP
+        # Number of pushes (positive) or pops (negative) not yet committed to the stack pointer in memory
+        self.spOffset = 0
+        # Count the stack commands addressed relative to the stack pointer, and the commits of the stack pointer
+        self.batchedCommands = 0
+        self.commits = 0
+        self.shortIndex = shortIndex
+        # Static frames of the functions using the static frame calling convention, by function name (see setStaticFrames)
+        self.frames = {}
+        self.frameWords = 0
+        # Count the call sites and returns using static frames
+        self.staticCallSites = 0
+        self.staticReturns = 0
+        # Count the tail calls reusing the frame of the calling function
+        self.tailCalls = 0
+        # Count call and return sites for the translation report
+        self.callSites = 0
+        self.returnSites = 0
+        # Count call sites by number of arguments, as the size of a shared call site depends on it
+        self.callArgs = {}
+        # Count comparisons routed through the shared routines and comparisons against zero translated inline
+        self.compareSites = 0
+        self.zeroCompareSites = 0
         # This dictionary translates between VM language and Hack assembly code arithmetic-logical commands
         self.ops_VM_to_As = {"eq": "JEQ", "lt": "JLT", "gt": "JGT", "add": "+", "sub": "-", "neg": "-", "not": "!", "and": "&", "or": "|"}
+        # This dictionary gives the jumps on the negated arithmetic comparisons
+        self.ops_negated = {"eq": "JNE", "lt": "JGE", "gt": "JLE"}
         # This dictionary translates between VM language memory segments and corresponding Hack assembly code pointers
         self.pointer_name = {"constant": "SP", "local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT", "temp": "5", "pointer": "3"}
         # Initialize a label counter to ensure unique labels for jumps
@@ -14,6 +65,9 @@ class CodeWriter:
         self.current_function = ''
         # Initialize a counter to keep track of the number of times a function generates a call
         self.call_counter   = 0
+        # Translation units are merged behind the bootstrap code of the CodeWriter writing the ASM-file
+        if not bootstrap:
+            return
         # Write the assembly instructions that effect the bootstrap code that starts the program's execution
         self.asmfile.write('// Bootstrap code\n')
         # Set SP (stack pointer) to 256
@@ -22,8 +76,39 @@ class CodeWriter:
         self.asmfile.write('@SP\n')
         self.asmfile.write('M=D\n')
         # Call OS-function 'Sys.init', which in turn per convention should then call the VM function 'Main.main'
-        self.current_function = 'Sys.init'
+        # (the return label is named after 'Bootstrap', so it cannot clash with the return labels of calls within 'Sys.init')
+        self.current_function = 'Bootstrap'
         self.writeCall('Sys.init', '0')
+        # The shared call/return routines are written once, right after the bootstrap code
+        if self.sharedCalls:
+            self.writeSharedCallRoutine()
+            self.writeSharedReturnRoutine()
+        if self.sharedCompare:
+            self.writeSharedCompareRoutines()
+
+    # Sets the static frames of the functions which are called with the static frame calling convention
+    # Such a function gets its arguments and locals at fixed RAM addresses, and its calls only save the return address
+    # and the stack pointer instead of building a frame on the stack
+    def setStaticFrames(self, frames, words):
+        self.frames = frames
+        self.frameWords = words
+
+    # Returns a copy of the counters of the translation report, which are summed up over the translation units of the parallel mode
+    def counters(self):
+        return {name: dict(getattr(self, name)) if name == 'callArgs' else getattr(self, name) for name in self.COUNTERS}
+
+    # Adds the report counters of a translation unit
+    def addCounters(self, counters):
+        for name, value in counters.items():
+            if name == 'callArgs':
+                for nargs, count in value.items():
+                    self.callArgs[nargs] = self.callArgs.get(nargs, 0) + count
+            else:
+                setattr(self, name, getattr(self, name) + value)
+
+    # Returns a unique label of the form 'prefixNAMEi' for the jumps within the code of a comparison
+    def uniqueLabel(self, name):
+        return self.labelPrefix + name + str(self.labelCounter)
 
     # Updates the file name when the translation of a new VM file has started
     def setFileName(self, fileName):
@@ -31,32 +116,57 @@ class CodeWriter:
 
     # Writes assembly code that effects the label command
     def writeLabel(self, label):
+        self.syncStack()
         # Set label of form '(functionName$label)'
         self.asmfile.write('(' + self.current_function + '$' + label + ')\n')
 
     # Writes assembly code that effects the if-goto command
     def writeIf(self, label):
-        # Decrement stack pointer and store register value to D
-        self.asmfile.write('@SP\n')
-        self.asmfile.write('AM=M-1\n')
-        self.asmfile.write('D=M\n')
+        # If the stack top is cached in D, it is popped already
+        if self.topInD:
+            self.useCachedTop()
+        # With batched stack pointer updates, load the stack top to D and commit the stack pointer before jumping
+        elif self.batchSP:
+            self.writeStackSlot(-1)
+            self.asmfile.write('D=M\n')
+            self.spOffset -= 1
+            self.commitStackPointer()
+        # Else decrement stack pointer and store register value to D
+        else:
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M\n')
         # Set A-register to mapped location of 'functionName$label' and write a conditional jump to address A if D != 0
         self.asmfile.write('@' + self.current_function + '$' + label + '\n')
         self.asmfile.write('D;JNE\n')
 
     # Writes assembly code that effects the goto command
     def writeGoTo(self, label):
+        self.syncStack()
         # Set A-register to mapped location of 'functionName$label' and write an unconditional jump to address A
         self.asmfile.write('@' + self.current_function + '$' + label + '\n')
         self.asmfile.write('0;JMP\n')
 
     # Writes assembly code that effects the function command
     def writeFunction(self, fname, nvars):
+        self.syncStack()
         # Reset call counter to 0 as we are now writing a new function
         self.call_counter   = 0
         # Store function name and set a function entry label of form '(functionName)'
         self.current_function = fname
         self.asmfile.write('(' + fname + ')\n')
+        # With a static frame, initialize the locals in the frame to 0 and save the pointers the function sets
+        if fname in self.frames:
+            frame = self.frames[fname]
+            for symbol in frame.local:
+                self.asmfile.write('@' + symbol + '\n')
+                self.asmfile.write('M=0\n')
+            for pointer, symbol in frame.pointers.items():
+                self.asmfile.write('@' + ['THIS', 'THAT'][pointer] + '\n')
+                self.asmfile.write('D=M\n')
+                self.asmfile.write('@' + symbol + '\n')
+                self.asmfile.write('M=D\n')
+            return
         # Set A-register to stack pointer base address (M)
         self.asmfile.write('@SP\n')
         self.asmfile.write('A=M\n')
@@ -68,6 +178,15 @@ class CodeWriter:
 
     # Writes assembly code that effects the call command
     def writeCall(self, fname, nargs):
+        self.syncStack()
+        if fname in self.frames:
+            self.writeStaticCall(fname, int(nargs))
+            return
+        self.callSites += 1
+        self.callArgs[nargs] = self.callArgs.get(nargs, 0) + 1
+        if self.sharedCalls:
+            self.writeSharedCall(fname, nargs)
+            return
         # Push return address to stack by using a pointer to the return address label 'functionName$ret.i'
         # Set A-register to function return address label 'functionName$ret.i', store address to D and push D to the stack
         self.asmfile.write('@' + self.current_function + '$ret.' + str(self.call_counter) + '\n')
@@ -108,6 +227,16 @@ class CodeWriter:
 
     # Writes assembly code that effects the return command
     def writeReturn(self):
+        self.syncStack()
+        if self.current_function in self.frames:
+            self.writeStaticReturn()
+            return
+        self.returnSites += 1
+        # In shared mode, the whole return sequence is carried out by the shared '$$RETURN' routine
+        if self.sharedCalls:
+            self.asmfile.write('@$$RETURN\n')
+            self.asmfile.write('0;JMP\n')
+            return
         # Set A-register to 'local base address - 5', which is the address containing the function return address
         self.asmfile.write('@LCL\n')
         self.asmfile.write('D=M\n')
@@ -119,6 +248,8 @@ class CodeWriter:
         self.asmfile.write('M=D\n')
         # Pop function return address to ARG0 (i.e. overwrite ARG0)
         self.writePushPop('C_POP', 'argument', 0)
+        # (the stack pointer is set explicitly, so a batched pop needs no commit)
+        self.spOffset = 0
         # Set stack pointer base address to ARG1
         self.asmfile.write('D=A+1\n')
         self.asmfile.write('@SP\n')
@@ -142,56 +273,42 @@ class CodeWriter:
 
     # Writes to the output file the assembly code that implements the given push/pop command
     def writePushPop(self, command, segment, index):
+        # With top-of-stack caching, pushes and pops go through D
+        if self.cacheTop:
+            self.writeCachedPushPop(command, segment, index)
+            return
+        # With batched stack pointer updates, pushes and pops address the stack slots relative to the stack pointer
+        if self.batchSP:
+            self.writeBatchedPushPop(command, segment, index)
+            return
+        # Else the assembly code only depends on the command and the address of 'segment index' (e.g. the static variable of the
+        # current file or the static frame of the current function), so it is taken from the template cache
+        self.writeTemplate((command, segment, index, self.fixedAddress(segment, index)), self.writeStackPushPop, command, segment, index)
+
+    # Writes assembly code that effects a push/pop command on the stack in memory
+    def writeStackPushPop(self, command, segment, index):
         # Pushes the register value at 'segment index' (e.g. 'argument 0') to the stack
         if command == 'C_PUSH':
             # Ensure segment is a valid segment
             if segment in ['constant', 'local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']:
-                # If segment is 'static', set address to the unique assembly symbol "FileName.i"
-                # The Hack assembler maps this symbolic variable on the host RAM, starting at address 16.
-                # Access this mapped address register value and store it to D
-                if segment == 'static':
-                    self.asmfile.write('@' + self.fileNameVM + '.' + str(index) + '\n')
-                    self.asmfile.write('D=M\n')
-                # Else find index address within segment and store that adresses' register value to D
-                else:
-                    # Store index value to D-register (for a 'constant' this is all that has to be done)
-                    self.asmfile.write('@' + str(index) + '\n')
-                    self.asmfile.write('D=A\n')
-                    # For all other segments...
-                    if segment in ['local', 'argument', 'this', 'that', 'temp', 'pointer']:
-                        # Set A-register to segment pointer location
-                        self.asmfile.write('@' + self.pointer_name[segment] + '\n')
-                        # For temp/pointer segments, add index value (D) to to segment pointer location (A) and update A-register
-                        if segment in ['temp', 'pointer']:
-                            self.asmfile.write('A=D+A\n')
-                        # For local/argument/this/that segments, update A-register to pointer base address (M) + index value (D)
-                        else:
-                            self.asmfile.write('A=D+M\n')
-                        # Store register value of that address to D
-                        self.asmfile.write('D=M\n')
-                # Push D to stack
+                # Store the value to D and push D to stack
+                self.writeLoadD(segment, index)
                 self.pushD_to_stack()
         # Pops the top-most stack value and saves it into the register at 'segment index' (e.g. 'argument 0')
         elif command == 'C_POP':
             # Ensure segment is a valid segment
             if segment in ['local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']:
-                # If segment is 'static', set address to the unique assembly symbol "FileName.i"
-                # The Hack assembler maps this symbolic variable on the host RAM, starting at address 16.
-                # Set A-register to this mapped address and store the address (the pop-target address) to D
-                if segment == 'static':
-                    self.asmfile.write('@' + self.fileNameVM + '.' + str(index) + '\n')
-                    self.asmfile.write('D=A\n')
-                # Else store index to D and locate pointer of respective segment
-                else:
-                    self.asmfile.write('@' + str(index) + '\n')
-                    self.asmfile.write('D=A\n')
-                    self.asmfile.write('@' + self.pointer_name[segment] + '\n')
-                # For temp/pointer segments, add up pointer location (A) and index value (D), then store to D
-                if segment in ['temp', 'pointer']:
-                    self.asmfile.write('D=A+D\n')
-                # For local/argument/this/that segments, add up pointer base address (M) and index value (D), then store to D
-                elif segment in ['local', 'argument', 'this', 'that']:
-                    self.asmfile.write('D=M+D\n')
+                # With specialized addressing, a target address known at translation time is addressed directly
+                address = self.fixedAddress(segment, index)
+                if address is not None and self.shortIndex is not None:
+                    self.asmfile.write('@SP\n')
+                    self.asmfile.write('AM=M-1\n')
+                    self.asmfile.write('D=M\n')
+                    self.asmfile.write('@' + address + '\n')
+                    self.asmfile.write('M=D\n')
+                    return
+                # Store the pop target address to D
+                self.writeAddressD(segment, index)
                 # We now have the pop target address stored in D, though still need the value to be popped
                 # Decrement stack pointer and add register value (the value to be popped) to D
                 self.asmfile.write('@SP\n')
@@ -202,8 +319,101 @@ class CodeWriter:
                 # Save popped value (which is now D-A) to target address register
                 self.asmfile.write('M=D-A\n')
 
+    # Returns the assembly symbol or address of 'segment index' if it is known at translation time, else None
+    # (static variables always, temp/pointer entries with specialized addressing only, argument/local entries of static frames)
+    def fixedAddress(self, segment, index):
+        if segment == 'static':
+            return self.fileNameVM + '.' + str(index)
+        if self.shortIndex is not None and segment == 'temp':
+            return str(5 + index)
+        if self.shortIndex is not None and segment == 'pointer':
+            return ['THIS', 'THAT'][index]
+        if segment in ['argument', 'local'] and self.current_function in self.frames:
+            return getattr(self.frames[self.current_function], segment)[index]
+        return None
+
+    # Returns True if 'segment index' is addressed by a specialized template (base address plus a short increment chain)
+    def isShortIndex(self, segment, index):
+        return self.shortIndex is not None and segment in ['local', 'argument', 'this', 'that'] and index <= self.shortIndex
+
+    # Writes assembly code that stores the value at 'segment index' (e.g. 'argument 0') to D
+    def writeLoadD(self, segment, index):
+        # If the address is known at translation time (e.g. the unique assembly symbol "FileName.i" of a static variable),
+        # access its register value and store it to D
+        # The Hack assembler maps symbolic variables on the host RAM, starting at address 16.
+        address = self.fixedAddress(segment, index)
+        if address is not None:
+            self.asmfile.write('@' + address + '\n')
+            self.asmfile.write('D=M\n')
+        # For small indexes, set A-register to the pointer base address (M) + 1 + 1 ... and store that register value to D
+        elif self.isShortIndex(segment, index):
+            self.asmfile.write('@' + self.pointer_name[segment] + '\n')
+            self.asmfile.write('A=M\n' if index == 0 else 'A=M+1\n')
+            for i in range(index - 1):
+                self.asmfile.write('A=A+1\n')
+            self.asmfile.write('D=M\n')
+        # Else find index address within segment and store that adresses' register value to D
+        else:
+            # Store index value to D-register (for a 'constant' this is all that has to be done)
+            self.asmfile.write('@' + str(index) + '\n')
+            self.asmfile.write('D=A\n')
+            # For all other segments...
+            if segment in ['local', 'argument', 'this', 'that', 'temp', 'pointer']:
+                # Set A-register to segment pointer location
+                self.asmfile.write('@' + self.pointer_name[segment] + '\n')
+                # For temp/pointer segments, add index value (D) to to segment pointer location (A) and update A-register
+                if segment in ['temp', 'pointer']:
+                    self.asmfile.write('A=D+A\n')
+                # For local/argument/this/that segments, update A-register to pointer base address (M) + index value (D)
+                else:
+                    self.asmfile.write('A=D+M\n')
+                # Store register value of that address to D
+                self.asmfile.write('D=M\n')
+
+    # Writes assembly code that stores the address of 'segment index' (e.g. 'local 2') to D
+    def writeAddressD(self, segment, index):
+        # If the address is known at translation time, set A-register to it and store it to D
+        address = self.fixedAddress(segment, index)
+        if address is not None:
+            self.asmfile.write('@' + address + '\n')
+            self.asmfile.write('D=A\n')
+            return
+        # For small indexes, store the pointer base address (M) + 1 + 1 ... to D
+        if self.isShortIndex(segment, index):
+            self.asmfile.write('@' + self.pointer_name[segment] + '\n')
+            self.asmfile.write('D=M\n' if index == 0 else 'D=M+1\n')
+            for i in range(index - 1):
+                self.asmfile.write('D=D+1\n')
+            return
+        # Else store index to D and locate pointer of respective segment
+        self.asmfile.write('@' + str(index) + '\n')
+        self.asmfile.write('D=A\n')
+        self.asmfile.write('@' + self.pointer_name[segment] + '\n')
+        # For temp/pointer segments, add up pointer location (A) and index value (D), then store to D
+        if segment in ['temp', 'pointer']:
+            self.asmfile.write('D=A+D\n')
+        # For local/argument/this/that segments, add up pointer base address (M) and index value (D), then store to D
+        else:
+            self.asmfile.write('D=M+D\n')
+
     # Writes to the output file the assembly code that implements the given arithmetic-logical command
     def writeArithmetic(self, command):
+        # With top-of-stack caching, the command operates on the stack top in D (shared comparisons work on memory though)
+        if self.cacheTop and not (command in ['eq', 'gt', 'lt'] and self.sharedCompare):
+            self.writeCachedArithmetic(command)
+            return
+        if self.batchSP and not (command in ['eq', 'gt', 'lt'] and self.sharedCompare):
+            self.writeBatchedArithmetic(command)
+            return
+        self.syncStack()
+        # The comparisons need unique labels, the assembly code of the other commands is taken from the template cache
+        if command not in ['eq', 'gt', 'lt']:
+            self.writeTemplate(command, self.writeStackArithmetic, command)
+        else:
+            self.writeStackArithmetic(command)
+
+    # Writes assembly code that effects an arithmetic-logical command on the stack in memory
+    def writeStackArithmetic(self, command):
         # If it is an addition or subtraction...
         if command in ['add', 'sub']:
                 # Decrement stack pointer and save register value to D
@@ -211,10 +421,23 @@ class CodeWriter:
                 self.asmfile.write('AM=M-1\n')
                 self.asmfile.write('D=M\n')
                 # Decrement stack pointer again and add D to RAM-value
+                self.asmfile.write('@SP\n')
                 self.asmfile.write('AM=M-1\n')
                 self.asmfile.write('M=M' + self.ops_VM_to_As[command] + 'D\n')
                 # increment stack pointer
+                self.asmfile.write('@SP\n')
                 self.asmfile.write('AM=M+1\n')
+        # If it is an arithmetic comparison and shared comparison routines are used...
+        elif command in ['eq', 'gt', 'lt'] and self.sharedCompare:
+                self.compareSites += 1
+                # Load return address label to D and jump to the shared routine '$$EQ', '$$GT' or '$$LT'
+                self.asmfile.write('@' + self.uniqueLabel('CMP') + '\n')
+                self.asmfile.write('D=A\n')
+                self.asmfile.write('@$$' + command.upper() + '\n')
+                self.asmfile.write('0;JMP\n')
+                # Set return label and increase counter
+                self.asmfile.write('(' + self.uniqueLabel('CMP') + ')\n')
+                self.labelCounter += 1
         # If it is an arithmetic comparison...
         elif command in ['eq', 'gt', 'lt']:
                 # Decrement stack pointer and save register value to D
@@ -222,21 +445,22 @@ class CodeWriter:
                 self.asmfile.write('AM=M-1\n')
                 self.asmfile.write('D=M\n')
                 # Decrement stack pointer and update D=M-D
+                self.asmfile.write('@SP\n')
                 self.asmfile.write('AM=M-1\n')
                 self.asmfile.write('D=M-D\n')
                 # Jump to (TRUE) if arithmetic comparison of D with 0 yields true
-                self.asmfile.write('@TRUE' + str(self.labelCounter) + '\n')
+                self.asmfile.write('@' + self.uniqueLabel('TRUE') + '\n')
                 self.asmfile.write('D;' + self.ops_VM_to_As[command] + '\n')
                 # Else store 0 (false) to D and unconditionally jump to (STORE)
                 self.asmfile.write('D=0\n')
-                self.asmfile.write('@STORE' + str(self.labelCounter) + '\n')
+                self.asmfile.write('@' + self.uniqueLabel('STORE') + '\n')
                 self.asmfile.write('0;JMP\n')
                 # Set (TRUE) label
-                self.asmfile.write('(TRUE' + str(self.labelCounter) + ')\n')
+                self.asmfile.write('(' + self.uniqueLabel('TRUE') + ')\n')
                 # Store -1 (true) to D
                 self.asmfile.write('D=-1\n')
                 # Set (STORE) label and increase counter
-                self.asmfile.write('(STORE' + str(self.labelCounter) + ')\n')
+                self.asmfile.write('(' + self.uniqueLabel('STORE') + ')\n')
                 self.labelCounter += 1
                 # Push truth value to stack
                 self.pushD_to_stack()
@@ -246,7 +470,7 @@ class CodeWriter:
             self.asmfile.write('@SP\n')
             self.asmfile.write('AM=M-1\n')
             self.asmfile.write('M=' + self.ops_VM_to_As[command] + 'M\n')
-            #self.asmfile.write('@SP\n')
+            self.asmfile.write('@SP\n')
             self.asmfile.write('AM=M+1\n')
         # If it is a boolean and/or...
         elif command in ['and', 'or']:
@@ -255,10 +479,611 @@ class CodeWriter:
             self.asmfile.write('AM=M-1\n')
             self.asmfile.write('D=M\n')
             # Decrement stack pointer and compare register value to D, store boolean result to register
+            self.asmfile.write('@SP\n')
             self.asmfile.write('AM=M-1\n')
             self.asmfile.write('M=M' + self.ops_VM_to_As[command] + 'D\n')
             # Increment stack pointer
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M+1\n')
+
+    # Writes the spill of a stack top cached in D to memory (nothing if the stack top is in memory already)
+    def spillTop(self):
+        if self.topInD:
+            self.spills += 1
+            self.asmfile.write('@SP\n')
             self.asmfile.write('AM=M+1\n')
+            self.asmfile.write('A=A-1\n')
+            self.asmfile.write('M=D\n')
+            self.topInD = False
+
+    # Marks the stack top cached in D as consumed by the current command
+    def useCachedTop(self):
+        self.cacheHits += 1
+        self.topInD = False
+
+    # Writes assembly code that implements the given push/pop command with top-of-stack caching
+    def writeCachedPushPop(self, command, segment, index):
+        # A push spills the cached stack top (if any) and loads the pushed value to D, which becomes the cached stack top
+        if command == 'C_PUSH':
+            if segment in ['constant', 'local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']:
+                self.spillTop()
+                self.writeLoadD(segment, index)
+                self.topInD = True
+        # A pop of a value in memory is translated as usual
+        elif not self.topInD:
+            self.cacheTop = False
+            self.writePushPop(command, segment, index)
+            self.cacheTop = True
+        # A pop of a value cached in D stores D to the target address directly
+        elif segment in ['local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']:
+            self.useCachedTop()
+            # A target address known at translation time can be addressed directly
+            address = self.fixedAddress(segment, index)
+            if address is not None:
+                self.asmfile.write('@' + address + '\n')
+                self.asmfile.write('M=D\n')
+            # Else keep the value in R13 while computing the target address, then add up target address (D) and value (M)
+            else:
+                self.asmfile.write('@R13\n')
+                self.asmfile.write('M=D\n')
+                self.writeAddressD(segment, index)
+                self.asmfile.write('@R13\n')
+                self.asmfile.write('D=D+M\n')
+                # Locate target address (D-M) and save the value (which is now D-A) to it
+                self.asmfile.write('A=D-M\n')
+                self.asmfile.write('M=D-A\n')
+
+    # Writes assembly code that implements the given arithmetic-logical command with top-of-stack caching
+    # The operand y (the stack top) is popped to D if not cached already, and the result is left cached in D
+    def writeCachedArithmetic(self, command):
+        # Make sure the stack top is in D (a cached stack top is popped already)
+        if self.topInD:
+            self.useCachedTop()
+        elif command in ['neg', 'not']:
+            # The unary operations can be applied while popping
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=' + self.ops_VM_to_As[command] + 'M\n')
+            self.topInD = True
+            return
+        else:
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M\n')
+        # Arithmetic or logical negation of D
+        if command in ['neg', 'not']:
+            self.asmfile.write('D=' + self.ops_VM_to_As[command] + 'D\n')
+        # Binary operations: pop x and combine it with y (D)
+        elif command in ['add', 'sub', 'and', 'or']:
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M' + self.ops_VM_to_As[command] + 'D\n')
+        # Comparisons: pop x and compute x-y, then set D to the truth value
+        elif command in ['eq', 'gt', 'lt']:
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M-D\n')
+            # Jump to (TRUE) if arithmetic comparison of D with 0 yields true, else store 0 (false) to D and jump to (STORE)
+            self.asmfile.write('@' + self.uniqueLabel('TRUE') + '\n')
+            self.asmfile.write('D;' + self.ops_VM_to_As[command] + '\n')
+            self.asmfile.write('D=0\n')
+            self.asmfile.write('@' + self.uniqueLabel('STORE') + '\n')
+            self.asmfile.write('0;JMP\n')
+            # Store -1 (true) to D
+            self.asmfile.write('(' + self.uniqueLabel('TRUE') + ')\n')
+            self.asmfile.write('D=-1\n')
+            self.asmfile.write('(' + self.uniqueLabel('STORE') + ')\n')
+            self.labelCounter += 1
+        self.topInD = True
+
+    # Brings the stack to its memory layout: spills a cached stack top and commits pending stack pointer updates
+    # Every template that reads the stack from memory, and all labels, jumps, calls and returns, start with it
+    def syncStack(self):
+        self.spillTop()
+        self.commitStackPointer()
+
+    # Writes the update of the stack pointer by the pending offset, without touching D (nothing if no update is pending)
+    def commitStackPointer(self):
+        if self.spOffset != 0:
+            self.commits += 1
+            self.asmfile.write('@SP\n')
+            for i in range(abs(self.spOffset)):
+                self.asmfile.write('M=M+1\n' if self.spOffset > 0 else 'M=M-1\n')
+            self.spOffset = 0
+
+    # Writes assembly code that sets A to the address of the stack slot 'stack pointer + pending offset + slot' without touching D
+    # (slot 0 is the first free slot, slot -1 the stack top); far slots are avoided by committing the pending offset first
+    def writeStackSlot(self, slot):
+        if abs(self.spOffset + slot) > self.MAX_OFFSET:
+            self.commitStackPointer()
+        offset = self.spOffset + slot
+        self.asmfile.write('@SP\n')
+        if offset == 0:
+            self.asmfile.write('A=M\n')
+        else:
+            self.asmfile.write('A=M+1\n' if offset > 0 else 'A=M-1\n')
+            for i in range(abs(offset) - 1):
+                self.asmfile.write('A=A+1\n' if offset > 0 else 'A=A-1\n')
+
+    # Writes assembly code that implements the given push/pop command with batched stack pointer updates
+    def writeBatchedPushPop(self, command, segment, index):
+        # A push stores the value (D) to the first free slot
+        if command == 'C_PUSH':
+            if segment in ['constant', 'local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']:
+                self.batchedCommands += 1
+                self.writeLoadD(segment, index)
+                self.writeStackSlot(0)
+                self.asmfile.write('M=D\n')
+                self.spOffset += 1
+        elif segment in ['local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']:
+            self.batchedCommands += 1
+            # A target address known at translation time can be addressed directly
+            address = self.fixedAddress(segment, index)
+            if address is not None:
+                self.writeStackSlot(-1)
+                self.asmfile.write('D=M\n')
+                self.asmfile.write('@' + address + '\n')
+                self.asmfile.write('M=D\n')
+            # Else add up the target address (D) and the stack top (M), then locate the target address (D-M) and save the value (D-A) to it
+            else:
+                self.writeAddressD(segment, index)
+                self.writeStackSlot(-1)
+                self.asmfile.write('D=D+M\n')
+                self.asmfile.write('A=D-M\n')
+                self.asmfile.write('M=D-A\n')
+            self.spOffset -= 1
+
+    # Writes assembly code that implements the given arithmetic-logical command with batched stack pointer updates
+    def writeBatchedArithmetic(self, command):
+        self.batchedCommands += 1
+        # A comparison addresses x again after its conditional jump, which must not commit the stack pointer on one path
+        # only, so commit it before if x is out of reach
+        if command in ['eq', 'gt', 'lt'] and abs(self.spOffset - 2) > self.MAX_OFFSET:
+            self.commitStackPointer()
+        # Locate the stack top y
+        self.writeStackSlot(-1)
+        # Arithmetic or logical negation in place
+        if command in ['neg', 'not']:
+            self.asmfile.write('M=' + self.ops_VM_to_As[command] + 'M\n')
+        # Binary operations: store y to D and combine it with x (the slot below) in place
+        elif command in ['add', 'sub', 'and', 'or']:
+            self.asmfile.write('D=M\n')
+            self.asmfile.write('A=A-1\n')
+            self.asmfile.write('M=M' + self.ops_VM_to_As[command] + 'D\n')
+            self.spOffset -= 1
+        # Comparisons: compute x-y, optimistically overwrite x with -1 (true) and keep it if the comparison yields true
+        elif command in ['eq', 'gt', 'lt']:
+            self.asmfile.write('D=M\n')
+            self.asmfile.write('A=A-1\n')
+            self.asmfile.write('D=M-D\n')
+            self.asmfile.write('M=-1\n')
+            self.asmfile.write('@' + self.uniqueLabel('TRUE') + '\n')
+            self.asmfile.write('D;' + self.ops_VM_to_As[command] + '\n')
+            # Else overwrite x with 0 (false)
+            self.writeStackSlot(-2)
+            self.asmfile.write('M=0\n')
+            # Set (TRUE) label and increase counter
+            self.asmfile.write('(' + self.uniqueLabel('TRUE') + ')\n')
+            self.labelCounter += 1
+            self.spOffset -= 1
+
+    # Writes the fused superinstruction 'push segment index / pop segment index': moves the value from memory to memory
+    def writeMove(self, source, sourceIndex, target, targetIndex):
+        self.syncStack()
+        # A target address known at translation time can be addressed directly
+        address = self.fixedAddress(target, targetIndex)
+        if address is not None:
+            self.writeLoadD(source, sourceIndex)
+            self.asmfile.write('@' + address + '\n')
+            self.asmfile.write('M=D\n')
+        # Else store the target address to R13 before loading the value
+        else:
+            self.writeAddressD(target, targetIndex)
+            self.asmfile.write('@R13\n')
+            self.asmfile.write('M=D\n')
+            self.writeLoadD(source, sourceIndex)
+            self.asmfile.write('@R13\n')
+            self.asmfile.write('A=M\n')
+            self.asmfile.write('M=D\n')
+
+    # Writes the fused superinstruction 'push segment index / add|sub|and|or': combines the operand with the stack top in place
+    def writePushArithmetic(self, segment, index, command):
+        self.syncStack()
+        # Adding or subtracting the constant 1 is a plain increment/decrement of the stack top
+        if segment == 'constant' and index == 1 and command in ['add', 'sub']:
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('A=M-1\n')
+            self.asmfile.write('M=M' + self.ops_VM_to_As[command] + '1\n')
+            return
+        # Store the operand to D, then update the stack top without touching the stack pointer
+        self.writeLoadD(segment, index)
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('A=M-1\n')
+        self.asmfile.write('M=M' + self.ops_VM_to_As[command] + 'D\n')
+
+    # Writes the fused superinstruction 'push segment index / push constant c / add|sub / pop segment index' (e.g. 'let i = i + 1')
+    def writeIncrement(self, segment, index, command, constant):
+        self.syncStack()
+        # Store the variable address to D
+        self.writeAddressD(segment, index)
+        # Adding or subtracting the constant 1 is a plain increment/decrement of the variable
+        if constant == 1:
+            self.asmfile.write('A=D\n')
+            self.asmfile.write('M=M' + self.ops_VM_to_As[command] + '1\n')
+        # Else keep the address in R13 while loading the constant to D
+        else:
+            self.asmfile.write('@R13\n')
+            self.asmfile.write('M=D\n')
+            self.asmfile.write('@' + str(constant) + '\n')
+            self.asmfile.write('D=A\n')
+            self.asmfile.write('@R13\n')
+            self.asmfile.write('A=M\n')
+            self.asmfile.write('M=M' + self.ops_VM_to_As[command] + 'D\n')
+
+    # Writes the fused superinstruction 'eq|gt|lt / if-goto label' (or 'eq|gt|lt / not / if-goto label' if negated)
+    # The comparison jumps directly, so the truth value is never pushed
+    def writeCompareBranch(self, command, label, negated=False):
+        # If the stack top is cached in D, it is popped already
+        if self.topInD:
+            self.useCachedTop()
+        # Else decrement stack pointer and save register value to D
+        else:
+            self.commitStackPointer()
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M\n')
+        # Decrement stack pointer and update D=M-D
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('AM=M-1\n')
+        self.asmfile.write('D=M-D\n')
+        # Jump to 'functionName$label' if the (negated) comparison of D with 0 yields true
+        self.asmfile.write('@' + self.current_function + '$' + label + '\n')
+        if negated:
+            self.asmfile.write('D;' + self.ops_negated[command] + '\n')
+        else:
+            self.asmfile.write('D;' + self.ops_VM_to_As[command] + '\n')
+
+    # Writes the fused superinstruction 'not / if-goto label': jumps if the popped value is not -1 (i.e. its negation is not 0)
+    def writeNotBranch(self, label):
+        # Store the popped value + 1 to D, which is 0 exactly if the value is -1 (a value cached in D is popped already)
+        if self.topInD:
+            self.useCachedTop()
+            self.asmfile.write('D=D+1\n')
+        else:
+            self.commitStackPointer()
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M+1\n')
+        self.asmfile.write('@' + self.current_function + '$' + label + '\n')
+        self.asmfile.write('D;JNE\n')
+
+    # Writes the fused superinstruction 'push segment index / if-goto label': branches on the value without pushing it
+    def writePushBranch(self, segment, index, label):
+        self.syncStack()
+        self.writeLoadD(segment, index)
+        self.asmfile.write('@' + self.current_function + '$' + label + '\n')
+        self.asmfile.write('D;JNE\n')
+
+    # Writes assembly code that compares the stack top against zero, i.e. effects 'push constant 0' followed by eq/gt/lt
+    # This inline fast path only touches the stack top, as the pushed 0 never needs to be stored
+    def writeCompareZero(self, command):
+        self.syncStack()
+        self.zeroCompareSites += 1
+        # Store stack top to D and optimistically overwrite it with -1 (true)
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('A=M-1\n')
+        self.asmfile.write('D=M\n')
+        self.asmfile.write('M=-1\n')
+        # Keep -1 if the comparison of D with 0 yields true
+        self.asmfile.write('@' + self.uniqueLabel('TRUE') + '\n')
+        self.asmfile.write('D;' + self.ops_VM_to_As[command] + '\n')
+        # Else overwrite stack top with 0 (false)
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('A=M-1\n')
+        self.asmfile.write('M=0\n')
+        # Set (TRUE) label and increase counter
+        self.asmfile.write('(' + self.uniqueLabel('TRUE') + ')\n')
+        self.labelCounter += 1
+
+    # Writes the shared comparison routines '$$EQ', '$$GT' and '$$LT', which expect the return address in D
+    # Each routine pops y, replaces x by the truth value of 'x op y' and returns via the return address saved in R15
+    def writeSharedCompareRoutines(self):
+        self.asmfile.write('// Shared comparison routines\n')
+        for command in ['eq', 'gt', 'lt']:
+            self.asmfile.write('($$' + command.upper() + ')\n')
+            # Save return address to R15
+            self.asmfile.write('@R15\n')
+            self.asmfile.write('M=D\n')
+            # Pop y to D, then compute x-y with A pointing to x
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M\n')
+            self.asmfile.write('A=A-1\n')
+            self.asmfile.write('D=M-D\n')
+            # Optimistically overwrite x with -1 (true) and return right away if the comparison of D with 0 yields true
+            self.asmfile.write('M=-1\n')
+            self.asmfile.write('@$$CMP$done\n')
+            self.asmfile.write('D;' + self.ops_VM_to_As[command] + '\n')
+            # Else continue at the common false branch (the last routine falls through to it)
+            if command != 'lt':
+                self.asmfile.write('@$$CMP$false\n')
+                self.asmfile.write('0;JMP\n')
+        # Common false branch: overwrite x with 0 (false)
+        self.asmfile.write('($$CMP$false)\n')
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('A=M-1\n')
+        self.asmfile.write('M=0\n')
+        # Common exit: jump to the return address
+        self.asmfile.write('($$CMP$done)\n')
+        self.asmfile.write('@R15\n')
+        self.asmfile.write('A=M\n')
+        self.asmfile.write('0;JMP\n')
+
+    # Writes assembly code that effects 'call fname nargs' directly followed by 'return' (a tail call), reusing the frame of
+    # the current function: the arguments are popped into the current argument segment, the stack is reset to the local
+    # base address and the function is jumped to; it then returns straight to the caller of the current function
+    # This requires the current function to have at least nargs arguments, so the new arguments fit into its argument segment
+    def writeTailCall(self, fname, nargs):
+        self.tailCalls += 1
+        # Pop the arguments in reverse order (the argument segment lies below the arguments on the stack, so none is overwritten)
+        for index in reversed(range(nargs)):
+            self.writePushPop('C_POP', 'argument', index)
+        # The rest of the stack is discarded (including a cached stack top or a pending stack pointer update)
+        self.topInD = False
+        self.spOffset = 0
+        # Set stack pointer to the local base address, where the function will set up its locals
+        self.asmfile.write('@LCL\n')
+        self.asmfile.write('D=M\n')
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('M=D\n')
+        # Jump to the function
+        self.asmfile.write('@' + fname + '\n')
+        self.asmfile.write('0;JMP\n')
+
+    # Writes a call site of a function with a static frame: pops the arguments into the frame, saves the stack pointer (the
+    # position of the return value) and the return address in the frame and jumps to the function
+    def writeStaticCall(self, fname, nargs):
+        self.staticCallSites += 1
+        frame = self.frames[fname]
+        for index in reversed(range(nargs)):
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M\n')
+            self.asmfile.write('@' + frame.argument[index] + '\n')
+            self.asmfile.write('M=D\n')
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('D=M\n')
+        self.asmfile.write('@' + frame.stackPointer + '\n')
+        self.asmfile.write('M=D\n')
+        self.asmfile.write('@' + self.current_function + '$ret.' + str(self.call_counter) + '\n')
+        self.asmfile.write('D=A\n')
+        self.asmfile.write('@' + frame.returnAddress + '\n')
+        self.asmfile.write('M=D\n')
+        self.asmfile.write('@' + fname + '\n')
+        self.asmfile.write('0;JMP\n')
+        # Set return address label, the called function will return to it
+        self.asmfile.write('(' + self.current_function + '$ret.' + str(self.call_counter) + ')\n')
+        self.call_counter += 1
+
+    # Writes the return of a function with a static frame: moves the return value to the saved stack pointer position,
+    # sets the stack pointer behind it, restores the pointers the function set and jumps to the saved return address
+    def writeStaticReturn(self):
+        self.staticReturns += 1
+        frame = self.frames[self.current_function]
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('A=M-1\n')
+        self.asmfile.write('D=M\n')
+        self.asmfile.write('@' + frame.stackPointer + '\n')
+        self.asmfile.write('A=M\n')
+        self.asmfile.write('M=D\n')
+        self.asmfile.write('D=A+1\n')
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('M=D\n')
+        for pointer, symbol in frame.pointers.items():
+            self.asmfile.write('@' + symbol + '\n')
+            self.asmfile.write('D=M\n')
+            self.asmfile.write('@' + ['THIS', 'THAT'][pointer] + '\n')
+            self.asmfile.write('M=D\n')
+        self.asmfile.write('@' + frame.returnAddress + '\n')
+        self.asmfile.write('A=M\n')
+        self.asmfile.write('0;JMP\n')
+
+    # Writes a call site that hands the return address (D), the callee address (R13) and nargs (R14) to the shared '$$CALL' routine
+    def writeSharedCall(self, fname, nargs):
+        # Store number of arguments to R14 (0 and 1 can be set directly)
+        if nargs in ['0', '1']:
+            self.asmfile.write('@R14\n')
+            self.asmfile.write('M=' + nargs + '\n')
+        else:
+            self.asmfile.write('@' + nargs + '\n')
+            self.asmfile.write('D=A\n')
+            self.asmfile.write('@R14\n')
+            self.asmfile.write('M=D\n')
+        # Store address of the called function to R13
+        self.asmfile.write('@' + fname + '\n')
+        self.asmfile.write('D=A\n')
+        self.asmfile.write('@R13\n')
+        self.asmfile.write('M=D\n')
+        # Load return address label 'functionName$ret.i' to D and jump to the shared routine
+        self.asmfile.write('@' + self.current_function + '$ret.' + str(self.call_counter) + '\n')
+        self.asmfile.write('D=A\n')
+        self.asmfile.write('@$$CALL\n')
+        self.asmfile.write('0;JMP\n')
+        # Set return address label, the called function will return to it
+        self.asmfile.write('(' + self.current_function + '$ret.' + str(self.call_counter) + ')\n')
+        self.call_counter += 1
+
+    # Writes the shared '$$CALL' routine, which every call site jumps to in shared mode
+    def writeSharedCallRoutine(self):
+        # '$$CALL' expects the return address in D, the callee address in R13 and the number of arguments in R14
+        self.asmfile.write('// Shared call routine\n')
+        self.asmfile.write('($$CALL)\n')
+        # Push return address (D) to the stack
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('A=M\n')
+        self.asmfile.write('M=D\n')
+        # Push the base addresses of local/argument/this/that to the stack
+        for pointer in ['LCL', 'ARG', 'THIS', 'THAT']:
+            self.asmfile.write('@' + pointer + '\n')
+            self.asmfile.write('D=M\n')
+            self.asmfile.write('@SP\n')
+            self.asmfile.write('AM=M+1\n')
+            self.asmfile.write('M=D\n')
+        # Increment stack pointer past the saved frame and reposition LCL to it
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('MD=M+1\n')
+        self.asmfile.write('@LCL\n')
+        self.asmfile.write('M=D\n')
+        # Reposition ARG to (stack pointer base address - 5 - nargs)
+        self.asmfile.write('@5\n')
+        self.asmfile.write('D=D-A\n')
+        self.asmfile.write('@R14\n')
+        self.asmfile.write('D=D-M\n')
+        self.asmfile.write('@ARG\n')
+        self.asmfile.write('M=D\n')
+        # Jump to the called function
+        self.asmfile.write('@R13\n')
+        self.asmfile.write('A=M\n')
+        self.asmfile.write('0;JMP\n')
+
+    # Writes the shared '$$RETURN' routine, which every return jumps to in shared mode
+    def writeSharedReturnRoutine(self):
+        # '$$RETURN' returns from the function whose frame LCL points to
+        self.asmfile.write('// Shared return routine\n')
+        self.asmfile.write('($$RETURN)\n')
+        # Store frame address (LCL) to R13 and the return address (located at frame-5) to R14
+        self.asmfile.write('@LCL\n')
+        self.asmfile.write('D=M\n')
+        self.asmfile.write('@R13\n')
+        self.asmfile.write('M=D\n')
+        self.asmfile.write('@5\n')
+        self.asmfile.write('A=D-A\n')
+        self.asmfile.write('D=M\n')
+        self.asmfile.write('@R14\n')
+        self.asmfile.write('M=D\n')
+        # Pop return value to ARG0 and set stack pointer to ARG1
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('AM=M-1\n')
+        self.asmfile.write('D=M\n')
+        self.asmfile.write('@ARG\n')
+        self.asmfile.write('A=M\n')
+        self.asmfile.write('M=D\n')
+        self.asmfile.write('D=A+1\n')
+        self.asmfile.write('@SP\n')
+        self.asmfile.write('M=D\n')
+        # Restore the 4 pointer base addresses which are located at frame-1/2/3/4
+        for pointer in ['THAT', 'THIS', 'ARG', 'LCL']:
+            self.asmfile.write('@R13\n')
+            self.asmfile.write('AM=M-1\n')
+            self.asmfile.write('D=M\n')
+            self.asmfile.write('@' + pointer + '\n')
+            self.asmfile.write('M=D\n')
+        # Jump to the return address
+        self.asmfile.write('@R14\n')
+        self.asmfile.write('A=M\n')
+        self.asmfile.write('0;JMP\n')
+
+    # Returns the assembly code a write method emits for the given arguments, without writing it to the output file
+    # Labels, counters and statistics are restored afterwards, so the rendering leaves no trace in the output
+    def render(self, method, *args):
+        saved = (self.asmfile, self.labelCounter, self.current_function, self.call_counter, self.topInD, self.spOffset)
+        counters = self.counters()
+        self.asmfile = OutputBuffer()
+        method(*args)
+        text = self.asmfile.getvalue()
+        (self.asmfile, self.labelCounter, self.current_function, self.call_counter, self.topInD, self.spOffset) = saved
+        for name, value in counters.items():
+            setattr(self, name, value)
+        return text
+
+    # Returns the assembly lines a write method emits for the given arguments, without writing them to the output file
+    def capture(self, method, *args):
+        return self.render(method, *args).splitlines()
+
+    # Writes the assembly code of a write method whose output is fully determined by the given key as one chunk
+    # The code is rendered on the first use of the key and then reused from the template cache
+    def writeTemplate(self, key, method, *args):
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = self.render(method, *args)
+        self.asmfile.write(template)
+
+    # Returns the number of instructions (ROM words) a write method emits for the given arguments
+    def measure(self, method, *args):
+        return sum(1 for line in self.capture(method, *args) if not line.startswith('(') and not line.startswith('//'))
+
+    # Returns the number of instructions (cycles) executed when running the code a write method emits, starting at its first
+    # instruction (or at the given label) until control leaves the emitted code; conditional jumps are taken or not as given
+    def pathLength(self, method, args, taken, start=None):
+        instructions, labels = [], {}
+        for line in self.capture(method, *args):
+            if line.startswith('('):
+                labels[line[1:-1]] = len(instructions)
+            elif not line.startswith('//'):
+                instructions.append(line)
+        pc, cycles, loaded = labels.get(start, 0), 0, None
+        while pc < len(instructions) and cycles < len(instructions) * 2:
+            instruction = instructions[pc]
+            cycles += 1
+            pc += 1
+            if instruction.startswith('@'):
+                loaded = instruction[1:]
+            elif ';' in instruction and (taken or instruction.endswith('JMP')):
+                # A jump leaves the emitted code unless it targets one of its own labels
+                if loaded not in labels:
+                    break
+                pc = labels[loaded]
+        return cycles
+
+    # Returns the lines of the translation report, describing the tradeoffs of the selected code generation modes
+    def report(self):
+        lines = []
+        # The inline sequences are measured without top-of-stack caching and batched stack pointer updates, and outside of
+        # any function (so a static frame of the last translated function doesn't change the measured return)
+        cacheTop, self.cacheTop = self.cacheTop, False
+        batchSP, self.batchSP = self.batchSP, False
+        current, self.current_function = self.current_function, ''
+        frames, self.frames = self.frames, {}
+        if self.sharedCalls:
+            # Measure the inline and the shared sequences; they are straight-line code, so instruction counts equal cycle counts
+            self.sharedCalls = False
+            inlineCall = {nargs: self.measure(self.writeCall, 'f', nargs) for nargs in self.callArgs}
+            inlineReturn = self.measure(self.writeReturn)
+            self.sharedCalls = True
+            sharedCall = {nargs: self.measure(self.writeCall, 'f', nargs) for nargs in self.callArgs}
+            sharedReturn = self.measure(self.writeReturn)
+            callRoutine, returnRoutine = self.measure(self.writeSharedCallRoutine), self.measure(self.writeSharedReturnRoutine)
+            saved = sum(count * (inlineCall[nargs] - sharedCall[nargs]) for nargs, count in self.callArgs.items())
+            saved += self.returnSites * (inlineReturn - sharedReturn) - callRoutine - returnRoutine
+            lines.append('Shared call/return routines: ' + str(self.callSites) + ' call sites, ' + str(self.returnSites) + ' returns, ' + str(saved) + ' ROM words saved')
+            lines.append('  ROM words per call site: ' + str(min(sharedCall.values(), default=0)) + '-' + str(max(sharedCall.values(), default=0)) + ' (inline ' + str(max(inlineCall.values(), default=0)) + '), per return: ' + str(sharedReturn) + ' (inline ' + str(inlineReturn) + '), shared routines: ' + str(callRoutine + returnRoutine))
+            lines.append('  Cycles per call: ' + str(max(sharedCall.values(), default=0) + callRoutine) + ' (inline ' + str(max(inlineCall.values(), default=0)) + '), per return: ' + str(sharedReturn + returnRoutine) + ' (inline ' + str(inlineReturn) + ')')
+        if self.sharedCompare:
+            # Measure the inline and the shared comparison code, and their cycle counts with the comparison yielding true/false
+            self.sharedCompare = False
+            inline = self.measure(self.writeArithmetic, 'lt')
+            inlineZero = self.measure(self.writePushPop, 'C_PUSH', 'constant', 0) + inline
+            inlineCycles = [self.pathLength(self.writeArithmetic, ('lt',), taken) for taken in (True, False)]
+            inlineZeroCycles = [self.measure(self.writePushPop, 'C_PUSH', 'constant', 0) + cycles for cycles in inlineCycles]
+            self.sharedCompare = True
+            shared, zero, routines = self.measure(self.writeArithmetic, 'lt'), self.measure(self.writeCompareZero, 'lt'), self.measure(self.writeSharedCompareRoutines)
+            sharedCycles = [shared + self.pathLength(self.writeSharedCompareRoutines, (), taken, '$$' + command) for command in ('EQ', 'GT', 'LT') for taken in (True, False)]
+            zeroCycles = [self.pathLength(self.writeCompareZero, ('lt',), taken) for taken in (True, False)]
+            saved = self.compareSites * (inline - shared) + self.zeroCompareSites * (inlineZero - zero) - routines
+            lines.append('Shared comparison routines: ' + str(self.compareSites) + ' comparisons routed to shared routines, ' + str(self.zeroCompareSites) + ' comparisons against zero inline, ' + str(saved) + ' ROM words saved')
+            lines.append('  ROM words per comparison: ' + str(shared) + ' (inline ' + str(inline) + '), against zero: ' + str(zero) + ' (inline ' + str(inlineZero) + '), shared routines: ' + str(routines))
+            lines.append('  Cycles per comparison: ' + str(min(sharedCycles)) + '-' + str(max(sharedCycles)) + ' (inline ' + str(min(inlineCycles)) + '-' + str(max(inlineCycles)) + '), against zero: ' + str(min(zeroCycles)) + '-' + str(max(zeroCycles)) + ' (inline ' + str(min(inlineZeroCycles)) + '-' + str(max(inlineZeroCycles)) + ')')
+        self.cacheTop, self.batchSP = cacheTop, batchSP
+        self.current_function, self.frames = current, frames
+        if self.batchSP:
+            lines.append('Batched stack pointer updates: ' + str(self.batchedCommands) + ' stack commands addressed relative to the stack pointer, ' + str(self.commits) + ' stack pointer commits')
+        if self.frames:
+            lines.append('Static frames: ' + str(len(self.frames)) + ' non-recursive functions with static frames, ' + str(self.staticCallSites) + ' call sites and ' + str(self.staticReturns) + ' returns without stack frames, ' + str(self.frameWords) + ' RAM words for all frames')
+        if self.tailCalls > 0:
+            lines.append('Tail calls: ' + str(self.tailCalls) + ' calls followed by return reuse the frame of the calling function')
+        if self.cacheTop:
+            lines.append('Top-of-stack caching: ' + str(self.cacheHits) + ' commands found the stack top in D, ' + str(self.spills) + ' spills to memory')
+        return lines
 
     # Closes the output file
     def close(self):
@@ -274,3 +1099,49 @@ class CodeWriter:
         self.asmfile.write('@SP\n')
         self.asmfile.write('AM=M+1\n')
 
+
+# Bounded output buffer which collects the assembly code in memory and writes it to the ASM-file in large chunks
+# Without a file, the whole assembly code is kept in memory (see getvalue)
+class OutputBuffer:
+
+    # Number of chunks collected before they are written to the file
+    LIMIT = 1 << 12
+
+    # Initializes an empty buffer for the given file (opened for writing) or for memory only
+    def __init__(self, file=None):
+        self.file = file
+        self.chunks = []
+        # Number of lines in the chunks written so far, counted up to the chunk at index counted (see lineNumber)
+        self.lines = 0
+        self.counted = 0
+        # Appending a chunk of assembly code is a plain list append, the size is checked once per VM command (see flushIfFull)
+        self.write = self.chunks.append
+
+    # Writes out the buffer once it is full
+    def flushIfFull(self):
+        if len(self.chunks) >= self.LIMIT and self.file is not None:
+            self.flush()
+
+    # Writes the collected chunks to the file with a single write and empties the buffer
+    def flush(self):
+        self.lineNumber()
+        self.file.write(''.join(self.chunks))
+        self.chunks.clear()
+        self.counted = 0
+
+    # Returns the number of lines written so far, i.e. the line number of the last complete line
+    def lineNumber(self):
+        for chunk in self.chunks[self.counted:]:
+            self.lines += chunk.count('\n')
+        self.counted = len(self.chunks)
+        return self.lines
+
+    # Returns the assembly code collected (and not yet written to the file)
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+    # Writes out the rest of the buffer and closes the file
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
@@ -0,0 +1,98 @@
+# Superinstruction fusion for the VMTranslator: recognizes common sequences of two to four VM commands and translates each
+# sequence with one fused CodeWriter template, which skips the stack round trip between the commands
+# A pattern is any function taking a window of VMCommand records and a CodeWriter; if the window starts with the pattern's
+# command sequence, it returns the number of commands to fuse together with the CodeWriter method and arguments writing
+# the fused code, else it returns None
+class Fusion:
+
+    # Number of commands the longest pattern spans
+    WINDOW = 4
+
+    # Initializes a Fusion instance with the given patterns (by default all patterns of this module, longest first)
+    def __init__(self, patterns=None):
+        if patterns is None:
+            patterns = [fuseIncrement, fuseCompareNotBranch, fuseCompareBranch, fuseNotBranch, fusePushBranch, fusePushArithmetic, fuseMove]
+        self.patterns = list(patterns)
+        # Number of times each pattern was applied, by pattern name, and number of VM commands fused overall
+        self.hits = {}
+        self.fused = 0
+
+    # This method registers an additional pattern, which is tried after the already registered ones
+    def addPattern(self, pattern):
+        self.patterns.append(pattern)
+
+    # This method returns the match (number of commands, write method, arguments) of the first pattern matching the
+    # commands at the given index, or None if no pattern matches
+    def match(self, commands, index, codewriter):
+        window = commands[index:index + self.WINDOW]
+        for pattern in self.patterns:
+            match = pattern(window, codewriter)
+            if match is not None:
+                self.hits[pattern.__name__] = self.hits.get(pattern.__name__, 0) + 1
+                self.fused += match[0]
+                return match
+        return None
+
+    # This method adds the pattern hits of a translation unit (parallel mode)
+    def addHits(self, hits, fused):
+        for name, count in hits.items():
+            self.hits[name] = self.hits.get(name, 0) + count
+        self.fused += fused
+
+    # Returns the lines of the fusion report: the number of hits of each pattern
+    def report(self):
+        lines = ['Superinstruction fusion: ' + str(self.fused) + ' VM commands fused into ' + str(sum(self.hits.values())) + ' superinstructions']
+        for pattern in self.patterns:
+            lines.append('  ' + pattern.__name__ + ': ' + str(self.hits.get(pattern.__name__, 0)) + ' hits')
+        return lines
+
+# Segments a value can be pushed from or popped to
+PUSH_SEGMENTS = ['constant', 'local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']
+POP_SEGMENTS = ['local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']
+
+# Returns True if the window holds a command of the given type at the given position, with arg1 in the given values (if any)
+def isCommand(window, position, commandType, arg1=None):
+    return position < len(window) and window[position].type == commandType and (arg1 is None or window[position].arg1 in arg1)
+
+# Pattern 'push segment index / push constant c / add|sub / pop segment index' (e.g. 'let i = i + 1'): updates the variable in place
+def fuseIncrement(window, codewriter):
+    if (isCommand(window, 0, 'C_PUSH', POP_SEGMENTS) and isCommand(window, 1, 'C_PUSH', ['constant']) and isCommand(window, 2, 'C_ARITHMETIC', ['add', 'sub'])
+            and isCommand(window, 3, 'C_POP', [window[0].arg1]) and window[3].arg2 == window[0].arg2):
+        return 4, codewriter.writeIncrement, (window[0].arg1, window[0].arg2, window[2].arg1, window[1].arg2)
+    return None
+
+# Pattern 'eq|gt|lt / not / if-goto label' (the condition of Jack if/while statements): jumps on the negated comparison
+def fuseCompareNotBranch(window, codewriter):
+    if isCommand(window, 0, 'C_ARITHMETIC', ['eq', 'gt', 'lt']) and isCommand(window, 1, 'C_ARITHMETIC', ['not']) and isCommand(window, 2, 'C_IF'):
+        return 3, codewriter.writeCompareBranch, (window[0].arg1, window[2].arg1, True)
+    return None
+
+# Pattern 'eq|gt|lt / if-goto label': jumps on the comparison without pushing its truth value
+def fuseCompareBranch(window, codewriter):
+    if isCommand(window, 0, 'C_ARITHMETIC', ['eq', 'gt', 'lt']) and isCommand(window, 1, 'C_IF'):
+        return 2, codewriter.writeCompareBranch, (window[0].arg1, window[1].arg1)
+    return None
+
+# Pattern 'not / if-goto label': jumps if the negation of the popped value is not 0
+def fuseNotBranch(window, codewriter):
+    if isCommand(window, 0, 'C_ARITHMETIC', ['not']) and isCommand(window, 1, 'C_IF'):
+        return 2, codewriter.writeNotBranch, (window[1].arg1,)
+    return None
+
+# Pattern 'push segment index / if-goto label': branches on the value without pushing it
+def fusePushBranch(window, codewriter):
+    if isCommand(window, 0, 'C_PUSH', PUSH_SEGMENTS) and isCommand(window, 1, 'C_IF'):
+        return 2, codewriter.writePushBranch, (window[0].arg1, window[0].arg2, window[1].arg1)
+    return None
+
+# Pattern 'push segment index / add|sub|and|or': combines the value with the stack top in place
+def fusePushArithmetic(window, codewriter):
+    if isCommand(window, 0, 'C_PUSH', PUSH_SEGMENTS) and isCommand(window, 1, 'C_ARITHMETIC', ['add', 'sub', 'and', 'or']):
+        return 2, codewriter.writePushArithmetic, (window[0].arg1, window[0].arg2, window[1].arg1)
+    return None
+
+# Pattern 'push segment index / pop segment index': moves the value from memory to memory
+def fuseMove(window, codewriter):
+    if isCommand(window, 0, 'C_PUSH', PUSH_SEGMENTS) and isCommand(window, 1, 'C_POP', POP_SEGMENTS):
+        return 2, codewriter.writeMove, (window[0].arg1, window[0].arg2, window[1].arg1, window[1].arg2)
+    return None
@@ -0,0 +1,146 @@
+from VMParser import VMCommand
+from CallGraph import CallGraph
+
+# Inlining of small leaf functions, run on the whole program before translation
+# A call of an inlinable function is replaced by its body: the arguments are popped to temp entries, the locals live in
+# temp entries as well, labels are renamed per call site and returns jump to the end of the inlined body
+# Only temp entries which the program never uses are handed out, so no value kept in a temp entry is overwritten
+class Inliner:
+
+    # Temp entries available for the arguments and locals of inlined functions, used from the highest one on
+    TEMP_ENTRIES = [7, 6, 5, 4, 3, 2, 1]
+
+    # Initializes an Inliner instance which inlines functions with at most budget VM commands in their body
+    def __init__(self, budget=8):
+        self.budget = budget
+        # Number of inlined call sites, by function name
+        self.inlined = {}
+        # Counter to make the labels of each inlined body unique
+        self.siteCounter = 0
+        # Temp entries not used anywhere in the program (see inline)
+        self.free = []
+
+    # This method returns the program with all calls of inlinable functions replaced by the function bodies
+    def inline(self, program):
+        callgraph = CallGraph(program)
+        used = {command.arg2 for fileName, commands in program for command in commands if command.type in ['C_PUSH', 'C_POP'] and command.arg1 == 'temp'}
+        self.free = [entry for entry in self.TEMP_ENTRIES if entry not in used]
+        result = []
+        for fileName, commands in program:
+            inlined = []
+            for command in commands:
+                if command.type == 'C_CALL' and self.isInlinable(callgraph, command.arg1, command.arg2, fileName):
+                    # The inlined commands are attributed to the line of the call site (e.g. in the source map)
+                    inlined += [expanded._replace(line=command.line) for expanded in self.expand(callgraph.bodies[command.arg1], command.arg2)]
+                    self.inlined[command.arg1] = self.inlined.get(command.arg1, 0) + 1
+                else:
+                    inlined.append(command)
+            result.append((fileName, inlined))
+        return result
+
+    # Returns True if calls of a function with nargs arguments from the given VM-file can be inlined: the function must be
+    # a leaf function within the size budget, it may only access the arguments passed and its locals, it must return a
+    # single value, its arguments and locals must fit into the free temp entries and its static variables (if any) must
+    # belong to the calling VM-file
+    def isInlinable(self, callgraph, name, nargs, fileName):
+        body = callgraph.bodies.get(name)
+        if body is None or callgraph.calls[name] or len(body) - 1 > self.budget:
+            return False
+        if callgraph.files[name] != fileName and any(command.arg1 == 'static' for command in body):
+            return False
+        count = {'argument': nargs, 'local': body[0].arg2}
+        if any(command.type in ['C_PUSH', 'C_POP'] and command.arg1 in count and command.arg2 >= count[command.arg1] for command in body):
+            return False
+        if not self.returnsSingleValue(body):
+            return False
+        return nargs + body[0].arg2 + 1 <= len(self.free)
+
+    # Returns True if the body leaves exactly one value on its stack at every return: a return discards all other values,
+    # while the inlined body would leave them on the caller's stack
+    # The body calls no function, so the stack depth at each command is known at translation time; a body whose depth at
+    # a label depends on the path it is reached on is not inlined either
+    def returnsSingleValue(self, body):
+        labels = {}
+        depth = 0
+        for command in body[1:]:
+            if command.type == 'C_LABEL':
+                # The depth at a label is the one of the jumps to it and of the preceding command (if it falls through)
+                if depth is None:
+                    depth = labels.get(command.arg1)
+                elif labels.setdefault(command.arg1, depth) != depth:
+                    return False
+                continue
+            # Commands after an unconditional jump or a return are only reached via a label
+            if depth is None:
+                continue
+            if command.type == 'C_PUSH':
+                depth += 1
+            elif command.type in ['C_POP', 'C_IF'] or (command.type == 'C_ARITHMETIC' and command.arg1 not in ['neg', 'not']):
+                depth -= 1
+            if depth < 0:
+                return False
+            if command.type in ['C_GOTO', 'C_IF']:
+                if labels.setdefault(command.arg1, depth) != depth:
+                    return False
+            if command.type == 'C_RETURN':
+                if depth != 1:
+                    return False
+            if command.type in ['C_GOTO', 'C_RETURN']:
+                depth = None
+        return True
+
+    # Returns the commands replacing a call of the given function body with nargs arguments
+    def expand(self, body, nargs):
+        self.siteCounter += 1
+        suffix = '$' + str(self.siteCounter)
+        name, nlocals = body[0].arg1, body[0].arg2
+        # Assign temp entries to the arguments, the locals and the return value
+        free = self.free
+        entries = {'argument': free[:nargs], 'local': free[nargs:nargs + nlocals]}
+        result = free[nargs + nlocals]
+        # The pointers set by the body are restored after it, just like a return restores THIS/THAT
+        pointers = sorted({command.arg2 for command in body if command.type == 'C_POP' and command.arg1 == 'pointer'})
+        commands = []
+        # Pop the arguments to their temp entries, initialize the locals to 0 and save the pointers set by the body
+        for index in reversed(range(nargs)):
+            commands.append(makeCommand('C_POP', 'temp', entries['argument'][index]))
+        for index in range(nlocals):
+            commands.append(makeCommand('C_PUSH', 'constant', 0))
+            commands.append(makeCommand('C_POP', 'temp', entries['local'][index]))
+        for pointer in pointers:
+            commands.append(makeCommand('C_PUSH', 'pointer', pointer))
+        # Copy the body, remapping arguments/locals to their temp entries and renaming the labels
+        end = name + '$end' + suffix
+        for index, command in enumerate(body[1:], 1):
+            if command.type in ['C_PUSH', 'C_POP'] and command.arg1 in entries:
+                commands.append(makeCommand(command.type, 'temp', entries[command.arg1][command.arg2]))
+            elif command.type in ['C_LABEL', 'C_GOTO', 'C_IF']:
+                commands.append(makeCommand(command.type, name + '$' + command.arg1 + suffix))
+            elif command.type == 'C_RETURN':
+                # A return leaves the return value on the stack; all but a final return jump to the end of the body
+                if index < len(body) - 1:
+                    commands.append(makeCommand('C_GOTO', end))
+            else:
+                commands.append(command)
+        if any(command.type == 'C_RETURN' for command in body[1:-1]):
+            commands.append(makeCommand('C_LABEL', end))
+        # Restore the saved pointers below the return value
+        if pointers:
+            commands.append(makeCommand('C_POP', 'temp', result))
+            for pointer in reversed(pointers):
+                commands.append(makeCommand('C_POP', 'pointer', pointer))
+            commands.append(makeCommand('C_PUSH', 'temp', result))
+        return commands
+
+    # Returns the lines of the inlining report
+    def report(self):
+        lines = ['Inlining: ' + str(sum(self.inlined.values())) + ' call sites of ' + str(len(self.inlined)) + ' leaf functions inlined (budget ' + str(self.budget) + ' VM commands)']
+        for name, count in self.inlined.items():
+            lines.append('  ' + name + ': ' + str(count) + ' call sites')
+        return lines
+
+# Returns the record of a push/pop/label/goto/if-goto command generated by the inliner
+def makeCommand(commandType, arg1, arg2=None):
+    keyword = {'C_PUSH': 'push', 'C_POP': 'pop', 'C_LABEL': 'label', 'C_GOTO': 'goto', 'C_IF': 'if-goto'}[commandType]
+    text = keyword + ' ' + arg1 + (' ' + str(arg2) if arg2 is not None else '')
+    return VMCommand(commandType, arg1, arg2, text)
@@ -0,0 +1,78 @@
+import itertools
+from collections import namedtuple
+
+# Record of a single parsed VM command and its source line number (arg1/arg2 are None where the command has no such
+# argument, arg2 is an integer; line is None for commands generated by the translator)
+VMCommand = namedtuple('VMCommand', ['type', 'arg1', 'arg2', 'text', 'line'], defaults=[None])
+
+# This module handles the parsing of a single .vm-file (named VMParser, so it can be imported next to the Assembler's Parser)
+class Parser:
+
+    # List of virtual machine language symbols for arithmetic-logical operations
+    ARITHMETIC_CLIST = ['add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not']
+    # This dictionary gives the command type of each command keyword
+    COMMAND_TYPES = {'push': 'C_PUSH', 'pop': 'C_POP', 'label': 'C_LABEL', 'if-goto': 'C_IF', 'goto': 'C_GOTO', 'function': 'C_FUNCTION', 'call': 'C_CALL', 'return': 'C_RETURN'}
+    COMMAND_TYPES.update((keyword, 'C_ARITHMETIC') for keyword in ARITHMETIC_CLIST)
+    # Command types with an integer second argument
+    ARG2_TYPES = {'C_PUSH', 'C_POP', 'C_FUNCTION', 'C_CALL'}
+
+    # This constructor reads the .vm-file and tokenizes every command exactly once into a VMCommand record
+    def __init__(self, vmfile):
+        # Turn every line containing a command into a record (comments, empty lines and white space are removed)
+        with open(vmfile) as file_object:
+            self.commands = [record for record in map(self.parseLine, file_object, itertools.count(1)) if record is not None]
+        # Initialize the cursor (index of the current command) and the currently processed command
+        self.index = -1
+        self.current_command = None
+
+    # This method turns a single line of VM code into a VMCommand record (returns None for empty/comment lines)
+    @classmethod
+    def parseLine(cls, line, number=None):
+        # Remove comments and leading and trailing white space
+        line = line.split('//', 1)[0].strip()
+        if not line:
+            return None
+        words = line.split()
+        keyword = words[0].casefold()
+        commandType = cls.COMMAND_TYPES.get(keyword)
+        # For arithmetic-logical commands the command itself is the first argument, a return command has none
+        if commandType == 'C_ARITHMETIC':
+            arg1 = keyword
+        elif commandType != 'C_RETURN':
+            arg1 = words[1]
+        else:
+            arg1 = None
+        # Only push/pop/function/call commands have a second argument
+        arg2 = int(words[2]) if commandType in cls.ARG2_TYPES else None
+        return VMCommand(commandType, arg1, arg2, line, number)
+
+    # Returns a boolean stating wether or not there are any lines left
+    def hasMoreLines(self):
+        return self.index + 1 < len(self.commands)
+
+    # Moves the cursor to the next command and makes it the current command
+    def advance(self):
+        self.index += 1
+        self.current_command = self.commands[self.index]
+
+    # Returns a constant representing the type of the current command
+    def commandType(self):
+        return self.current_command.type
+
+    # Returns the first argument of the current command
+    def arg1(self):
+        # For a return command, return an error message
+        if self.current_command.type == 'C_RETURN':
+            return 'C_RETURN has no arg1'
+        return self.current_command.arg1
+
+    # Returns the second argument of the current command
+    def arg2(self):
+        # Only return a second argument for push/pop/function/call commands, for all other commands return an error message
+        if self.current_command.arg2 is None:
+            return 'Only PUSH/POP/FUNCTION/CALL arguments have arg2'
+        return self.current_command.arg2
+
+    # Returns the current command as a VMCommand record
+    def record(self):
+        return self.current_command
@@ -1,62 +1,329 @@
 import os
-import sys
 import glob
-from Parser import Parser
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from VMParser import Parser
 from CodeWriter import CodeWriter
+from Fusion import Fusion
+from CallGraph import CallGraph, removeUnreachableFunctions, allocateStaticFrames
+from Inliner import Inliner
 
 # This module drives the overall translation process
 class VMTranslator:
+
+    # Modules whose source code is part of the key of a cached translation unit (see cacheKey)
+    CACHE_SOURCES = ['VMTranslator.py', 'VMParser.py', 'CodeWriter.py', 'Fusion.py']
+
     # This constructor initializes a VMTranslator instance and translates a VM-file or all VM-files in a folder
-    def __init__(self):
-        # Get input argument and check if it is a directory
-        userInput = sys.argv[1]
+    # The keyword options select alternative code generation modes of the CodeWriter
+    # With jobs other than 1, the VM-files are translated on that many worker processes (0: one per CPU)
+    # With cacheDir, the translation units of the VM-files are stored in that directory and reused as long as the VM-file,
+    # the options and the program-wide information they depend on are unchanged
+    # With release, the ASM-file has no inline '// command' comments; a source map is written to a MAP-file instead
+    # With toMemory, no ASM-file is written: the assembly code is kept as string in the asm attribute
+    # Without userInput, the instance only translates the VM-files handed to it as translation units (see translateUnit)
+    def __init__(self, userInput, sharedCalls=False, sharedCompare=False, fuse=False, cacheTop=False, batchSP=False, shortIndex=None, treeShake=False, inline=None, staticFrames=False, tailCalls=False, jobs=1, cacheDir=None, release=False, toMemory=False):
+        # Batched stack pointer updates rely on the stack slots in RAM, which a cached top of the stack keeps in D instead
+        if batchSP and cacheTop:
+            raise ValueError('batchSP cannot be combined with cacheTop')
+        # Create a CodeWriter instance
+        codewriter = CodeWriter(userInput if not toMemory else None, sharedCalls, sharedCompare, cacheTop, batchSP, shortIndex, bootstrap=userInput is not None)
+        self.codewriter = codewriter
+        self.sharedCompare = sharedCompare
+        # With fuse, common command sequences are translated as superinstructions
+        self.fusion = Fusion() if fuse else None
+        # In release mode, the ASM line range of each translated command is recorded as (first line, last line, VM-file,
+        # VM line, function) instead of writing the command as comment
+        self.release = release
+        self.sourceMap = []
+        # The call graph needed for tail calls is built once the program is read
+        self.callgraph = None
+        # The options a translation unit of the parallel mode is translated with
+        self.options = {'sharedCalls': sharedCalls, 'sharedCompare': sharedCompare, 'fuse': fuse, 'cacheTop': cacheTop, 'batchSP': batchSP, 'shortIndex': shortIndex, 'release': release}
+        if userInput is None:
+            return
+        # Check if the input is a directory
         #isFile = os.path.isfile(userInput)
         isDirectory = os.path.isdir(userInput)
-        # Create a CodeWriter instance
-        codewriter = CodeWriter(userInput)
         # Put all files in a list called "files" and loop through
         files = []
-        if isDirectory: 
+        if isDirectory:
             files = glob.glob(userInput + '/*.vm')
         else:
             files = [userInput]
-        # Loop through all VM-files in the list and translate them into assembly code
+        # Read all VM-files in the list into lists of command records, so that program-wide passes can run before translation
+        program = []
         for i in range(len(files)):
             # Create a parser instance for the current VM-file
             parser = Parser(files[i])
-            # Inform the CodeWriter instance about the current VM-file name
-            if isDirectory:
-                codewriter.setFileName(files[i].split('.')[0].split('/')[1])
-            else:
-                codewriter.setFileName(files[i].split('.')[0])
-            # Translate the VM-file line by line
-            while parser.hasMoreLines() == True:
-                # Move to next line
-                parser.advance()
-                # Write current VM command to ASM-file for tracking purposes
-                codewriter.asmfile.write('// ' + parser.current_command + '\n')
-                # Determine command type and translate it
-                if parser.commandType() in ['C_PUSH', 'C_POP']:
-                    codewriter.writePushPop(parser.commandType(), parser.arg1(), int(parser.arg2()))
-                elif parser.commandType() == 'C_ARITHMETIC':
-                    codewriter.writeArithmetic(parser.arg1())
-                elif parser.commandType() == 'C_LABEL':
-                    codewriter.writeLabel(parser.arg1())
-                elif parser.commandType() == 'C_IF':
-                    codewriter.writeIf(parser.arg1())
-                elif parser.commandType() == 'C_GOTO':
-                    codewriter.writeGoTo(parser.arg1())
-                elif parser.commandType() == 'C_FUNCTION':
-                    codewriter.writeFunction(parser.arg1(), int(parser.arg2()))
-                elif parser.commandType() == 'C_CALL':
-                    codewriter.writeCall(parser.arg1(), parser.arg2())
-                elif parser.commandType() == 'C_RETURN':
-                    codewriter.writeReturn()  
+            # Determine the current VM-file name without folders and extension (used for static variables and, as the
+            # name of a translation unit, for its labels), so it is unique for every VM-file of a program on any path
+            fileName = os.path.splitext(os.path.basename(files[i]))[0]
+            # The parser tokenizes the VM-file into a list of command records, which the passes work on directly
+            program.append((fileName, parser.commands))
+        # With an inlining budget, replace calls of small leaf functions by their bodies
+        self.inliner = None
+        if inline is not None:
+            self.inliner = Inliner(inline)
+            program = self.inliner.inline(program)
+        # With treeShake, leave out the functions that cannot be reached from Sys.init
+        self.removed = None
+        if treeShake:
+            program, self.removed = removeUnreachableFunctions(program)
+            # Measure the ROM words the removed functions would have taken
+            self.removedWords = sum(self.measureCommands(fileName, body) for fileName, name, body in self.removed)
+        # With staticFrames, non-recursive functions get their arguments and locals at fixed RAM addresses
+        if staticFrames:
+            codewriter.setStaticFrames(*allocateStaticFrames(program))
+        # With tailCalls, the call graph tells how many arguments each function receives at least
+        if tailCalls:
+            self.callgraph = CallGraph(program)
+        # Translate all VM-files into assembly code
+        self.reused = None
+        if jobs != 1 or cacheDir is not None:
+            self.translateUnits(program, jobs or None, cacheDir)
+        else:
+            for fileName, commands in program:
+                # Inform the CodeWriter instance about the current VM-file name
+                codewriter.setFileName(fileName)
+                self.translateCommands(commands)
         # After all VM-files have been translated, create an infinite loop at the end of the ASM-file and close it
+        # (the stack is brought to its memory layout first, so the final stack is in memory)
+        codewriter.syncStack()
         codewriter.asmfile.write('(END)\n')
         codewriter.asmfile.write('@END\n')
         codewriter.asmfile.write('0;JMP')
+        self.asm = codewriter.asmfile.getvalue() if toMemory else None
         codewriter.close()
+        if release and not toMemory:
+            self.writeSourceMap(userInput.split('.')[0] + '.map')
+
+    # Translates a list of command records
+    def translateCommands(self, commands):
+        # Each step may consume several commands at once
+        index = 0
+        while index < len(commands):
+            index += self.translate(commands, index)
+            self.codewriter.asmfile.flushIfFull()
+
+    # Translates the VM-files as separate translation units, on a pool of worker processes (with jobs other than 1) and
+    # reusing the units stored in cacheDir (if given)
+    # The program-wide passes have run already, so each unit only needs the options, the static frames and the call graph;
+    # the units' assembly code is merged in the order of the VM-files behind the bootstrap code, so the ASM-file is the
+    # same no matter in which order the workers finish or which units come from the cache
+    def translateUnits(self, program, jobs, cacheDir):
+        codewriter = self.codewriter
+        units = [(self.options, (codewriter.frames, codewriter.frameWords), self.callgraph, fileName, commands) for fileName, commands in program]
+        results = [None] * len(units)
+        if cacheDir is not None:
+            os.makedirs(cacheDir, exist_ok=True)
+            sources = self.sourceDigest()
+            keys = [self.cacheKey(sources.copy(), unit) for unit in units]
+            results = [loadUnit(cacheDir, key) for key in keys]
+            self.reused = len(units) - results.count(None)
+        # Translate the units which are not cached
+        missing = [i for i in range(len(units)) if results[i] is None]
+        if jobs != 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                translated = list(executor.map(translateUnit, [units[i] for i in missing]))
+        else:
+            translated = [translateUnit(units[i]) for i in missing]
+        for i, result in zip(missing, translated):
+            results[i] = result
+            if cacheDir is not None:
+                storeUnit(cacheDir, keys[i], result)
+        for asm, counters, hits, sourceMap in results:
+            # The source map of a unit counts the lines from the start of the unit
+            offset = codewriter.asmfile.lineNumber()
+            self.sourceMap += [(first + offset, last + offset, fileName, line, function) for first, last, fileName, line, function in sourceMap]
+            codewriter.asmfile.write(asm)
+            codewriter.addCounters(counters)
+            if hits is not None:
+                self.fusion.addHits(*hits)
+
+    # Returns a hash of the translator's source code, so that cached units are invalidated by changes of the code generation
+    def sourceDigest(self):
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for source in self.CACHE_SOURCES:
+            with open(os.path.join(directory, source), 'rb') as file_object:
+                digest.update(file_object.read())
+        return digest
+
+    # Returns the cache key of a translation unit: the given hash of the translator's source code, extended by the options,
+    # the file name and the commands of the unit (after the program-wide passes); static frames and the call graph depend
+    # on the whole program, so they are part of the key if used
+    def cacheKey(self, digest, unit):
+        options, frames, callgraph, fileName, commands = unit
+        digest.update(repr((sorted(options.items()), fileName)).encode())
+        digest.update('\n'.join(command.text for command in commands).encode())
+        # The source map of a unit refers to the line numbers of its commands
+        if options['release']:
+            digest.update(repr([command.line for command in commands]).encode())
+        if frames[0]:
+            digest.update(repr(frames).encode())
+        if callgraph is not None:
+            digest.update(repr(sorted(callgraph.nargs.items())).encode())
+        return digest.hexdigest()
+
+    # Returns the number of ROM words the given commands of a VM-file translate to, without writing them to the ASM-file
+    def measureCommands(self, fileName, commands):
+        # A separate Fusion instance keeps the pattern hit counts of the actual translation
+        fusion = self.fusion
+        if fusion is not None:
+            self.fusion = Fusion(fusion.patterns)
+        # The measured commands are left out of the source map as well
+        sourceMap, self.sourceMap = self.sourceMap, []
+        self.codewriter.setFileName(fileName)
+        words = self.codewriter.measure(self.translateCommands, commands)
+        self.fusion = fusion
+        self.sourceMap = sourceMap
+        return words
+
+    # Translates the command at the given index (or a fused sequence of commands starting there) and returns the number of commands consumed
+    def translate(self, commands, index):
+        codewriter = self.codewriter
+        command = commands[index]
+        # With fusion, try to translate a sequence of commands as one superinstruction
+        match = self.fusion.match(commands, index, codewriter) if self.fusion is not None else None
+        # With shared comparisons, 'push constant 0' followed by eq/gt/lt is translated by the inline fast path
+        if match is None and self.sharedCompare and command.text.split() == ['push', 'constant', '0'] and index + 1 < len(commands) and commands[index + 1].type == 'C_ARITHMETIC' and commands[index + 1].arg1 in ['eq', 'gt', 'lt']:
+            match = 2, codewriter.writeCompareZero, (commands[index + 1].arg1,)
+        # With tail calls, 'call' directly followed by 'return' reuses the current frame (if the called function fits into it)
+        if match is None and self.isTailCall(commands, index):
+            match = 2, codewriter.writeTailCall, (command.arg1, command.arg2)
+        # Write the translated VM commands to ASM-file for tracking purposes (in release mode, the source map tracks them)
+        length = match[0] if match is not None else 1
+        if self.release:
+            start = codewriter.asmfile.lineNumber()
+        elif length == 1:
+            codewriter.asmfile.write('// ' + command.text + '\n')
+        else:
+            codewriter.asmfile.write(''.join('// ' + fused.text + '\n' for fused in commands[index:index + length]))
+        if match is not None:
+            match[1](*match[2])
+        # Else translate the single command
+        elif command.type in ['C_PUSH', 'C_POP']:
+            codewriter.writePushPop(command.type, command.arg1, command.arg2)
+        elif command.type == 'C_ARITHMETIC':
+            codewriter.writeArithmetic(command.arg1)
+        elif command.type == 'C_LABEL':
+            codewriter.writeLabel(command.arg1)
+        elif command.type == 'C_IF':
+            codewriter.writeIf(command.arg1)
+        elif command.type == 'C_GOTO':
+            codewriter.writeGoTo(command.arg1)
+        elif command.type == 'C_FUNCTION':
+            codewriter.writeFunction(command.arg1, command.arg2)
+        elif command.type == 'C_CALL':
+            codewriter.writeCall(command.arg1, str(command.arg2))
+        elif command.type == 'C_RETURN':
+            codewriter.writeReturn()
+        if self.release:
+            end = codewriter.asmfile.lineNumber()
+            if end > start:
+                self.sourceMap.append((start + 1, end, codewriter.fileNameVM, command.line, codewriter.current_function))
+        return length
+
+    # Returns True if the command at the given index is a call that can be translated as tail call: it must be directly
+    # followed by a return, the current function must receive at least as many arguments as it passes, and neither function
+    # may use a static frame
+    def isTailCall(self, commands, index):
+        if self.callgraph is None or commands[index].type != 'C_CALL' or index + 1 >= len(commands) or commands[index + 1].type != 'C_RETURN':
+            return False
+        current, frames = self.codewriter.current_function, self.codewriter.frames
+        return commands[index].arg2 <= self.callgraph.minArguments(current) and current not in frames and commands[index].arg1 not in frames
+
+    # Writes the source map to a MAP-file: one line per translated command (or fused sequence of commands) giving the range
+    # of ASM lines it was translated to, its VM-file, its VM line and the function it belongs to
+    def writeSourceMap(self, filename):
+        with open(filename, 'w') as mapfile:
+            mapfile.write('// ASM lines, VM-file, VM line, function\n')
+            for first, last, fileName, line, function in self.sourceMap:
+                mapfile.write(str(first) + '-' + str(last) + ' ' + fileName + '.vm ' + str(line) + ' ' + function + '\n')
+
+    # Returns the lines of the translation report
+    def report(self):
+        lines = self.codewriter.report()
+        if self.fusion is not None:
+            lines += self.fusion.report()
+        if self.inliner is not None:
+            lines += self.inliner.report()
+        if self.reused is not None:
+            lines.append('Translation cache: ' + str(self.reused) + ' VM-files reused')
+        if self.removed is not None:
+            lines.append('Tree shaking: ' + str(len(self.removed)) + ' functions unreachable from Sys.init removed, ' + str(self.removedWords) + ' ROM words saved')
+            for fileName, name, body in self.removed:
+                lines.append('  ' + name + ' (' + fileName + '.vm, ' + str(len(body)) + ' VM commands)')
+        return lines
+
+# Translates one VM-file as translation unit (runs in a worker process of the parallel mode)
+# Returns the unit's assembly code, whose comparison labels are prefixed with the file name, together with its report
+# counters, fusion pattern hits and source map (release mode)
+def translateUnit(unit):
+    options, frames, callgraph, fileName, commands = unit
+    translator = VMTranslator(None, **options)
+    translator.callgraph = callgraph
+    codewriter = translator.codewriter
+    codewriter.labelPrefix = fileName + '$'
+    codewriter.setStaticFrames(*frames)
+    codewriter.setFileName(fileName)
+    translator.translateCommands(commands)
+    # The next unit starts with the stack in memory, so bring it there at the end of this one
+    codewriter.syncStack()
+    fusion = translator.fusion
+    return codewriter.asmfile.getvalue(), codewriter.counters(), (fusion.hits, fusion.fused) if fusion is not None else None, translator.sourceMap
+
+# Returns a translation unit (assembly code, report counters, fusion hits, source map) stored in the cache directory, or None
+def loadUnit(cacheDir, key):
+    try:
+        with open(os.path.join(cacheDir, key + '.json')) as file_object:
+            return json.load(file_object)
+    except (OSError, ValueError):
+        return None
+
+# Stores a translation unit in the cache directory (written to a temporary file first, so a cached unit is never incomplete)
+def storeUnit(cacheDir, key, result):
+    path = os.path.join(cacheDir, key + '.json')
+    with open(path + '.tmp', 'w') as file_object:
+        json.dump(result, file_object)
+    os.replace(path + '.tmp', path)
+
+# Translates a VM-file or all VM-files in a folder with the given options and returns the assembly code as string,
+# e.g. for the assembler to consume directly, instead of writing an ASM-file
+def translateProgram(userInput, **options):
+    return VMTranslator(userInput, toMemory=True, **options).asm
+
+# Command line interface: translates a VM-file or a folder of VM-files into one ASM-file
+def main():
+    # Get input arguments: the VM-file or folder and the code generation options
+    argparser = argparse.ArgumentParser(description='Translates VM code into Hack assembly code.')
+    argparser.add_argument('input', help='VM-file or folder containing VM-files')
+    argparser.add_argument('--shared-calls', action='store_true', help='let call sites and returns jump to shared call/return routines (smaller ROM, slightly more cycles)')
+    argparser.add_argument('--shared-compare', action='store_true', help='let eq/gt/lt jump to shared comparison routines, comparisons against zero stay inline (smaller ROM, more cycles)')
+    argparser.add_argument('--fuse', action='store_true', help='translate common sequences of VM commands as fused superinstructions (smaller and faster)')
+    argparser.add_argument('--cache-top', action='store_true', help='keep the stack top in the D-register and only spill it to memory when needed (fewer instructions executed)')
+    argparser.add_argument('--batch-sp', action='store_true', help='address stack slots relative to the stack pointer and only update it at block exits (not combinable with --cache-top)')
+    argparser.add_argument('--short-index', type=int, metavar='N', help='use specialized addressing templates for segment indexes up to N, and absolute addresses for temp/pointer')
+    argparser.add_argument('--tree-shake', action='store_true', help='leave out all functions that cannot be reached from Sys.init')
+    argparser.add_argument('--inline', type=int, metavar='N', help='replace calls of leaf functions with at most N VM commands by their bodies')
+    argparser.add_argument('--static-frames', action='store_true', help='give non-recursive functions their arguments and locals at fixed RAM addresses, so their calls need no stack frame')
+    argparser.add_argument('--tail-calls', action='store_true', help="translate 'call' directly followed by 'return' as a jump reusing the current frame")
+    argparser.add_argument('--jobs', type=int, default=1, help='translate the VM-files as separate units on this many worker processes (0: one per CPU)')
+    argparser.add_argument('--cache', metavar='DIR', help='store the translation of each VM-file in this directory and reuse it while the file and the options are unchanged')
+    argparser.add_argument('--release', action='store_true', help="leave out the '// command' comments and write a MAP-file mapping the ASM lines to the VM-files, lines and functions")
+    argparser.add_argument('--report', action='store_true', help='print a report on the selected code generation modes')
+    args = argparser.parse_args()
+    if args.batch_sp and args.cache_top:
+        argparser.error('--batch-sp cannot be combined with --cache-top')
+    # Create a VMTranslator instance which kicks off the translation process
+    translator = VMTranslator(args.input, sharedCalls=args.shared_calls, sharedCompare=args.shared_compare, fuse=args.fuse, cacheTop=args.cache_top, batchSP=args.batch_sp, shortIndex=args.short_index, treeShake=args.tree_shake, inline=args.inline, staticFrames=args.static_frames, tailCalls=args.tail_calls, jobs=args.jobs, cacheDir=args.cache, release=args.release)
+    if args.report:
+        for line in translator.report():
+            print(line)
 
-# Create a VMTranslator instance which kicks off the translation process       
-translate = VMTranslator()
\ No newline at end of file
+# Kick off the translation process when run as a script
+if __name__ == '__main__':
+    main()